@@ -1,237 +1,430 @@
-import requests
+import os
+import time
 import json
+import queue
+import secrets
 import threading
+from concurrent.futures import Future
+from WheelSync import WheelSync
+from WheelState import WheelState
+from DrawEngine import DrawEngine
+import WheelArchive
+from Metrics import metrics
+
+#archive format -> file extension of the wheel archives of a channel
+ARCHIVE_FORMATS = {'binary': 'wheel', 'jsonl': 'jsonl'}
 
 #TODO: do we need a mechanism to flush doubled_odds_usernames during execution?
 
 class BotManager:
-    def __init__(self, max_users, won_key, admins, wheel_name):
+    def __init__(self, max_users, won_key, admins, draw_log=None, archive_dir=None):
         """fields:
-        usernames: list of usernames whoare part of the wheel
-        doubled odds usernames: a set of usernames who doubled their odds once during the execution of the bots
+        wheels: dict of channel name -> the wheel of every channel the bots run in. Wheels are added with add_wheel,
+                and are a WheelState kept in memory, or a SharedWheelState shared with the bot managers of other processes
         MAX USERS: maximum amount of users allowed to be on a wheel, defined in the config
         WON_KEY: the wheel of names API key for user, whose wheels will be accessed and changed
-        usernames and toggle locks: thread locks to guarantee mutual exclusion to shared data objects
-        allowed users: privilaged users defined in the config who are allowed to use privilaged commands
-        wheel name: name of the wheel that will be acted upon for wheel of name commands.
-                    If the given wheel name doesnt exist when creating a wheel, a new wheel wil be made, 
-                    otherwise, the existing one is edited
-                    If the given wheel with name doesnt exist when trying to load from, a failure is given, and an exection is raised  
+        auto_sync_wakeup: event to make the background sync, if started, push the wheels right away instead of at its next interval
+        commands: queue of commands submitted by the bots, waiting to be executed by the writer
+        writer: the only thread that reads or changes the wheel states. Commands are executed one at a time in the order
+                they were submitted, so no locks are needed and check-then-change commands can't race each other.
+                a single writer serves the wheels of all channels. Wheels shared with other processes
+                are kept atomic across them by the transactions of their store
+        allowed users: privilaged users defined in the config who are allowed to use privilaged commands. twitch logins,
+                       matched case insensitively, and youtube identities, see YtBot.identity, matched exactly.
+                       the admins of the wheels added without admins of their own
+        wheel_admins: dict of channel name -> the allowed users of the wheels added with admins of their own.
+                      they can only run the privilaged commands on that wheel, not on the wheels of the other channels
+        draw_log: optional path of a file every draw is recorded in as a json line, with what it takes to check it
+        archive_dir: optional directory the wheels are exported to and imported from, see WheelArchive
         """
 
-        self.usernames = []
-        self.doubled_odds_usernames = set()
+        self.wheels = {}
         self.MAX_USERS = max_users
         self.WON_KEY = won_key
-        self.usernames_lock = threading.Lock()
-        self.toggle_lock = threading.Lock()
         self.allowed_users = admins
-        self.wheel_name = wheel_name
+        self.wheel_admins = {}
+        self.draw_log = draw_log
+        self.archive_dir = archive_dir
+        self.auto_sync_wakeup = threading.Event()
 
-        self.listening = False
-        self.doubling_allowed = False
+        self.commands = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.__process_commands, daemon=True)
+        self.writer.start()
 
-    def __is_user_allowed(self, user):
-        """Helper function to check if the user is allowed to run certain commands."""
-        return user.lower() in self.allowed_users
+        metrics.set_gauge('manager_queue_depth', self.commands.qsize)
 
-    def __unique_usernames(self):
-        """helper function to return the count of unique usernames"""
-        return len(set(self.usernames))
-    
-    def toggle_listening(self, user, toggle) -> int:
-        """"toggle for the bots to allow or disallow the collection of usernames
-        exit codes:
+    def __process_commands(self):
+        """writer loop, executes the submitted commands one by one and hands their exit codes back through their futures.
+        the time commands wait in the queue is recorded, it is what the bots wait on besides the command itself
+        """
+        while True:
+            future, command, args, submitted = self.commands.get()
+            metrics.observe('manager_queue_wait_seconds', time.perf_counter() - submitted)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                with metrics.timer('manager_command_seconds', command=command.__name__.rpartition('__')[2]):
+                    future.set_result(command(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def __submit(self, command, *args) -> Future:
+        """queue a command for the writer, return value is a future that resolves to the exit code of the command"""
+        future = Future()
+        self.commands.put((future, command, args, time.perf_counter()))
+        return future
+
+    def backlog(self):
+        """return the amount of commands waiting for the writer"""
+        return self.commands.qsize()
+
+    def __wheel(self, channel) -> WheelState:
+        """return the wheel of a channel, raises KeyError if no wheel was added for it"""
+        return self.wheels[channel.lower()]
+
+    def __is_user_allowed(self, channel, user):
+        """Helper function to check if the user is allowed to run certain commands on the wheel of a channel."""
+        allowed_users = self.wheel_admins.get(channel.lower(), self.allowed_users)
+        return user in allowed_users or user.lower() in allowed_users
+
+    def add_wheel(self, channel, wheel_name, journal=None, store=None, admins=None):
+        """give a channel a wheel of its own, called wheel_name on wheel of names.
+        If the wheel name doesnt exist when creating a wheel, a new wheel wil be made, otherwise, the existing one is edited
+        if a journal is given, every change to the wheel is written to it, and the wheel it holds is restored here.
+        if a SqliteStore or PostgresStore is given, the wheel is kept in it instead of in memory, and shared with every process using the same store.
+        the journal isn't used then, the store is durable by itself.
+        if admins are given, they are the only users allowed to run the privilaged commands on this wheel, instead of the allowed users
+        """
+        if admins is not None:
+            self.wheel_admins[channel.lower()] = admins
+        self.__submit(self.__add_wheel, channel.lower(), wheel_name, journal, store).result()
+
+    def __add_wheel(self, channel, wheel_name, journal, store):
+        wheel_sync = WheelSync(self.WON_KEY, wheel_name)
+        if store is not None:
+            wheel = store.wheel(channel, wheel_name, wheel_sync)
+        else:
+            wheel = WheelState(channel, wheel_name, wheel_sync, journal)
+
+        self.wheels[channel] = wheel
+        metrics.set_gauge('wheel_entrants', wheel.size, channel=channel)
+
+    def is_listening(self, channel):
+        """return if the bots are collecting usernames in a channel. read outside the writer, so it may lag a command behind"""
+        return self.__wheel(channel).is_listening()
+
+    def toggle_listening(self, channel, user, toggle) -> Future:
+        """"toggle for the bots to allow or disallow the collection of usernames in a channel
+        return value is a future of the exit code:
         -2 random failure, should never happen tbh
         -1: given user is not privilaged, therefore cannot execute this command
         0: success
         """
-        if not self.__is_user_allowed(user):
-            return -1
+        return self.__submit(self.__toggle_listening, self.__wheel(channel), user, toggle)
 
-        #critical section
-        self.toggle_lock.acquire()
+    def __toggle_listening(self, wheel, user, toggle) -> int:
+        if not self.__is_user_allowed(wheel.channel, user):
+            return -1
 
-        self.listening = toggle
+        wheel.set_listening(toggle)
 
-        self.toggle_lock.release()
+        #push what was collected right away when collection stops, so the wheel is ready for the spin
+        if not toggle:
+            wheel.sync_requested = True
+            self.auto_sync_wakeup.set()
 
-        if self.listening != toggle:
+        if wheel.is_listening() != toggle:
             return -2
         else: return 0
 
-    def toggle_doubling(self, user) -> int:
-        """"toggle for the bots to allow or disallow the doubling of username odds
+    def toggle_doubling(self, channel, user) -> Future:
+        """"toggle for the bots to allow or disallow the doubling of username odds in a channel
         so, allow the use of !here command
-        exit codes:
+        return value is a future of the exit code:
         -1: given user is not privilaged, therefore cannot execute this command
         0: success, doubling is not allowed
         1: success, doubling is allowed
         """
-        if not self.__is_user_allowed(user):
-            return -1
-    
-        #critical section
-        self.toggle_lock.acquire()
+        return self.__submit(self.__toggle_doubling, self.__wheel(channel), user)
 
-        self.doubling_allowed = not self.doubling_allowed
+    def __toggle_doubling(self, wheel, user) -> int:
+        if not self.__is_user_allowed(wheel.channel, user):
+            return -1
 
-        self.toggle_lock.release()
+        if wheel.toggle_doubling(): return 1
+        else: return 0
 
-        if self.doubling_allowed: return 1 
-        else: return 0 
 
-    
-    def add_username_to_wheel(self, username) -> int:
-        """add a given username to the list.
-        exit codes:
+    def add_username_to_wheel(self, channel, username) -> Future:
+        """add a given username to the wheel of a channel.
+        return value is a future of the exit code:
         -3: bots are not allowed to listen currently
         -2: Maximum name limit has been reached
         -1: Given username is already present in the list
-        0: success 
+        0: success
         """
-        if not self.listening:
-            return -3
+        return self.__submit(self.__add_username_to_wheel, self.__wheel(channel), username)
 
-        if self.__unique_usernames() >= self.MAX_USERS:
-            return -2
-        
-        if username in self.usernames:
-            return -1
-        
-        #critical section
-        self.usernames_lock.acquire()
+    def __add_username_to_wheel(self, wheel, username) -> int:
+        return wheel.join(username, self.MAX_USERS)
 
-        self.usernames.append(username)
-
-        self.usernames_lock.release()
-        return 0
-    
-    def double_odds(self, username) -> int:
+    def double_odds(self, channel, username) -> Future:
         """
-        double the odds of a given username, essentialls doubling their occurance in the list
-        exit codes:
-        -4: doubling odds is not allowed during active listening, 
+        double the odds of a given username on the wheel of a channel, essentially doubling their weight on the wheel
+        return value is a future of the exit code:
+        -4: doubling odds is not allowed during active listening,
         -3: doubling was not allowed yet
         -2: username has already double their odds once this stream
         -1: the username cannot double their odds, because they don't occur at least once already in the list usernames
         0: success
         """
-        if self.listening:
-            return -4
-        
-        if not self.doubling_allowed:
-            return -3
+        return self.__submit(self.__double_odds, self.__wheel(channel), username)
 
-        if username in self.doubled_odds_usernames:
-            return -2
-        
-        if username not in self.usernames:
-            return -1
-        
-        #critical section
-        self.usernames_lock.acquire()
+    def __double_odds(self, wheel, username) -> int:
+        return wheel.double(username)
 
-        odds = self.usernames.count(username)
-        for _ in range (odds):
-            self.usernames.append(username)
-        self.doubled_odds_usernames.add(username)
+    def __snapshot(self, wheel, while_listening=False):
+        """copy the wheel to upload, along with its version. None if the bots are listening, unless while_listening is set.
+        only run by the writer. the usernames are None, instead of a copy, if the remote wheel already holds this version.
+        takes the pending sync request of the wheel, a push of the snapshot that fails has to put it back with __sync_failed
+        """
+        snapshot = wheel.snapshot(wheel.wheel_sync.synced_version, while_listening)
+        if snapshot is not None:
+            wheel.sync_requested = False
+        return snapshot
+
+    def __sync_failed(self, wheel):
+        """request the sync of a wheel again after its push failed, so the background sync retries it even once the bots stopped listening"""
+        wheel.sync_requested = True
+
+    def __replace_usernames(self, wheel, entries) -> int:
+        """replace the wheel with the entries of a loaded wheel, repeated entries add up to the weight.
+        only run by the writer, fails if the bots started listening while the wheel was being loaded
+        """
+        usernames = {}
+        for entry in entries:
+            user = entry['text']
+            usernames[user] = usernames.get(user, 0) + 1
 
-        self.usernames_lock.release()
+        version = wheel.replace(usernames)
+        if version is None:
+            return -2
 
+        #the remote wheel now holds exactly what was loaded
+        wheel.wheel_sync.loaded(version)
         return 0
-    
-    def create_wheel(self, username):
-        """create a wheel from the usernames list stored. The private wheel is created in the account of the key holder
-        if the wheel name defined in the config doesn't exist, a wheel will be created, if it exists, then the wheel will be overriden instead
+
+    def create_wheel(self, channel, username):
+        """create a wheel from the usernames stored for a channel. The private wheel is created in the account of the key holder
+        if the wheel name of the channel doesn't exist, a wheel will be created, if it exists, then the wheel will be overriden instead
+        nothing is uploaded if the wheel didn't change since it was last created or loaded.
+        the wheel is read by the writer, the request itself is made on the calling thread, and blocks it.
         exit codes:
         -2: Wheel of names API error occured
         -1: given username is not allowed to run this command
         0: success
         """
 
-        if not self.__is_user_allowed(username):
+        if not self.__is_user_allowed(channel, username):
             return -1
 
-        if self.listening:
+        wheel = self.__wheel(channel)
+        snapshot = self.__submit(self.__snapshot, wheel).result()
+        if snapshot is None:
             return -2
 
-        #critical section
-        self.usernames_lock.acquire()
-
-        wheel = {
-            'config': {
-                'title': self.wheel_name,
-                'description': 'A wheel of elite Ghostdivers.',
-                'entries': [{'text': user} for user in self.usernames]
-            }
-        }
+        try:
+            wheel.wheel_sync.push(*snapshot)
+            return 0
 
-        self.usernames_lock.release()
+        except Exception as e:
+            self.__sync_failed(wheel)
+            return -2
 
-        url = 'https://wheelofnames.com/api/v1/wheels/private'
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json, application/xml',
-            'x-api-key': self.WON_KEY
-        }
+    def load_wheel(self, channel, username):
+        """load the wheel with the wheel name of a channel into its list.
+        the request is made on the calling thread, and blocks it. the loaded wheel is then applied by the writer.
+        exit codes:
+        -2: Wheel of names API error occured
+        -1: given username is not allowed to run this command
+        0: success
+        """
+        if not self.__is_user_allowed(channel, username):
+            return -1
 
-        try: #response is not used for anything currently, could be removed in the future.
-            response = requests.put(url, headers=headers, data=json.dumps(wheel))
-            response.raise_for_status()
-            jsonResponse = response.json()
-            path = jsonResponse['data']['path']
+        wheel = self.__wheel(channel)
+        if wheel.is_listening():
+            return -2
 
-            return 0
-            
-        
+        try:
+            entries = wheel.wheel_sync.pull()
         except Exception as e:
             return -2
-        
-    def load_wheel(self, username):
-        """load a wheel with the name defined in the config file into the list.:
-        -2: Wheel of names API error occured
+
+        if entries is not None:
+            #if a wheel is found, grab the usernames from entries section
+            return self.__submit(self.__replace_usernames, wheel, entries).result()
+        else:
+            return -2
+
+    def __entrants(self, wheel):
+        """copy the whole wheel along with its version, None if the bots are listening. only run by the writer"""
+        return wheel.snapshot(None)
+
+    def draw(self, channel, username, count=1, seed=None):
+        """draw count winners from the wheel of a channel, without wheel of names. every entry of a user is a chance to win,
+        and a user wins at most once per draw. the seed is random unless given, the same wheel and seed always draw the same winners.
+        the wheel is copied by the writer, the draw itself is made on the calling thread.
+        return value is the exit code, or a (0, details) pair on success, details holding the list of winners and the seed:
+        -4: the wheel is empty
+        -3: count is not a positive number
+        -2: drawing is not allowed during active listening
         -1: given username is not allowed to run this command
-        0: success
         """
-        if not self.__is_user_allowed(username):
+        if not self.__is_user_allowed(channel, username):
             return -1
 
-        if self.listening:
-            return -2        
-        url = "https://wheelofnames.com/api/v1/wheels/private"
-        headers = {
-            'Accept': 'application/json',
-            'x-api-key': self.WON_KEY
+        if count < 1:
+            return -3
+
+        wheel = self.__wheel(channel)
+        entrants = self.__submit(self.__entrants, wheel).result()
+        if entrants is None:
+            return -2
+
+        usernames, version = entrants
+        if not usernames:
+            return -4
+
+        if seed is None:
+            seed = secrets.token_hex(8)
+
+        with metrics.timer('draw_seconds'):
+            winners = DrawEngine(usernames).draw(count, seed)
+
+        record = {
+            'time': time.time(),
+            'channel': wheel.channel,
+            'version': version,
+            'entrants': len(usernames),
+            'entries': sum(usernames.values()),
+            'fingerprint': DrawEngine.fingerprint(usernames),
+            'seed': seed,
+            'count': count,
+            'winners': winners,
+            'drawn_by': username,
         }
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            jsonresponse = response.json()
-
-            wheels = jsonresponse['data'] ['wheels']
-            #grab the wheel name from the llocal config file
-            wheel_name = self.wheel_name
-            wheel_found = None
-            #loop over the titles from the json response and grab the wheel that matches the name.
-            for wheel in wheels:
-                if wheel['config']['title'] == wheel_name:
-                    wheel_found = wheel
-                    break
+        print(f"draw in {wheel.channel}: {json.dumps(record)}")
+        if self.draw_log is not None:
+            #the record was printed above, a draw log that can't be written doesn't take the draw back
+            try:
+                with open(self.draw_log, 'a') as log_file:
+                    log_file.write(json.dumps(record) + '\n')
+            except OSError as e:
+                print(f"Failed to write the draw in {wheel.channel} to {self.draw_log}: {e}")
+
+        #the chat only gets the first winners of a big draw, as many as its messages can hold, the full list is in the record
+        return 0, {'winners': winners, 'seed': seed}
+
+    def __entries(self, wheel):
+        """copy the whole wheel and who doubled their odds on it. only run by the writer"""
+        return wheel.entries()
+
+    def __restore(self, wheel, usernames, doubled):
+        """replace the wheel with an imported one. only run by the writer, fails if the bots are listening"""
+        if wheel.restore(usernames, doubled) is None:
+            return -2
+        return 0
 
-        except Exception as e:
+    def archive_path(self, channel, archive_format='binary'):
+        """return the path of the archive of a channel in the given format, None if there is no archive_dir or the format is unknown"""
+        extension = ARCHIVE_FORMATS.get(archive_format)
+        if self.archive_dir is None or extension is None:
+            return None
+        return os.path.join(self.archive_dir, f'{channel.lower()}.{extension}')
+
+    def export_wheel(self, channel, username, archive_format='binary'):
+        """write the wheel of a channel, along with who doubled their odds, to its archive in archive_dir.
+        the wheel is copied by the writer, the archive is written on the calling thread.
+        return value is the exit code, or a (0, details) pair on success, details holding the file name of the archive:
+        -3: no archive_dir is configured, or the format is unknown
+        -2: the archive couldn't be written
+        -1: given username is not allowed to run this command
+        """
+        if not self.__is_user_allowed(channel, username):
+            return -1
+
+        path = self.archive_path(channel, archive_format)
+        if path is None:
+            return -3
+
+        usernames, doubled = self.__submit(self.__entries, self.__wheel(channel)).result()
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with metrics.timer('wheel_archive_seconds', op='export', format=archive_format):
+                WheelArchive.export_wheel(path, usernames, doubled)
+        except OSError as e:
+            print(f"Failed to export the wheel of {channel} to {path}: {e}")
             return -2
 
-        if wheel_found:
-            #critical section
-            self.usernames_lock.acquire()
+        return 0, {'file': os.path.basename(path), 'entrants': len(usernames)}
 
-            #if a wheel is found, grab the usernames from entries section
-            entries = wheel_found['config']['entries']
-            self.usernames.clear()
-            self.usernames.extend([entry['text'] for entry in entries])
+    def import_wheel(self, channel, username, archive_format='binary'):
+        """replace the wheel of a channel, along with who doubled their odds, with its archive in archive_dir.
+        the archive is read as a stream on the calling thread, the read wheel is then applied by the writer.
+        return value is the exit code, or a (0, details) pair on success, details holding the amount of users imported:
+        -4: the archive is missing or not a valid archive
+        -3: no archive_dir is configured, or the format is unknown
+        -2: importing is not allowed during active listening
+        -1: given username is not allowed to run this command
+        """
+        if not self.__is_user_allowed(channel, username):
+            return -1
 
-            self.usernames_lock.release()
-            return 0               
-        else:
+        path = self.archive_path(channel, archive_format)
+        if path is None:
+            return -3
+
+        wheel = self.__wheel(channel)
+        if wheel.is_listening():
             return -2
+
+        try:
+            with metrics.timer('wheel_archive_seconds', op='import', format=archive_format):
+                usernames, doubled = WheelArchive.import_wheel(path)
+        except (OSError, ValueError) as e:
+            print(f"Failed to import the wheel of {channel} from {path}: {e}")
+            return -4
+
+        ret = self.__submit(self.__restore, wheel, usernames, doubled).result()
+        if ret != 0:
+            return ret
+        return 0, {'entrants': len(usernames)}
+
+    def start_auto_sync(self, interval):
+        """start pushing the wheels to wheel of names in the background while the bots are listening.
+        a wheel is pushed at most once every interval seconds and only if it changed, plus once right after listening stops.
+        the requests are made on a thread of their own, so neither the writer nor the bots wait on them.
+        """
+        thread = threading.Thread(target=self.__auto_sync, args=(interval,), daemon=True)
+        thread.start()
+
+    def __auto_sync(self, interval):
+        """background sync loop, see start_auto_sync"""
+        while True:
+            self.auto_sync_wakeup.wait(interval)
+            self.auto_sync_wakeup.clear()
+
+            for wheel in list(self.wheels.values()):
+                if not (wheel.sync_requested or wheel.is_listening()):
+                    continue
+
+                snapshot = self.__submit(self.__snapshot, wheel, True).result()
+                try:
+                    if wheel.wheel_sync.push(*snapshot):
+                        print(f"wheel of {wheel.channel} synced to wheel of names")
+                except Exception as e:
+                    self.__sync_failed(wheel)
+                    print(f"Failed to sync the wheel of {wheel.channel}, retrying in {interval} seconds: {e}")
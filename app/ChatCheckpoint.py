@@ -0,0 +1,102 @@
+import os
+import json
+from collections import deque
+
+class ChatCheckpoint:
+    """
+        Where the youtube bot of one livestream stopped reading its chat, kept in a file so a restarted bot carries on from there
+        instead of starting over. Holds the page token of the next poll, the id and time of the last commands processed,
+        and the time the bot first started reading the chat.
+        The id of a chat message is the idempotency key of its command: a command whose id was already processed is never run again,
+        even if its page is read a second time, like when the saved page token expired and the chat is read from the newest messages.
+        The file is written to a temporary file first and swapped in, so there is always one complete checkpoint on disk.
+    """
+    def __init__(self, path, max_ids=1000):
+        """fields:
+        path: path of the checkpoint file, its directory is created if missing
+        page_token: page token to resume polling with, None to start from the newest messages
+        started_ms: epoch time in milliseconds the first bot reading the chat started at, None until a bot started.
+                    a bot restarted before any command was processed resumes from it, so the commands sent meanwhile are not dropped as old
+        last_message_id: id of the last command processed
+        last_sent_ms: epoch time in milliseconds the last command processed was sent at, None if none was processed yet
+        max_ids: amount of processed message ids remembered, the oldest are forgotten first
+        processed_ids: set of the remembered ids, for constant time lookups
+        order: double-ended queue of the remembered ids, in the order they were processed
+        dirty: set when something changed since the checkpoint was last saved
+        """
+        self.path = path
+        self.page_token = None
+        self.started_ms = None
+        self.last_message_id = None
+        self.last_sent_ms = None
+        self.max_ids = max_ids
+        self.processed_ids = set()
+        self.order = deque()
+        self.dirty = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path):
+            try:
+                with open(path) as checkpoint_file:
+                    checkpoint = json.load(checkpoint_file)
+                self.page_token = checkpoint['page_token']
+                self.started_ms = checkpoint.get('started_ms')
+                self.last_message_id = checkpoint['last_message_id']
+                self.last_sent_ms = checkpoint['last_sent_ms']
+                for message_id in checkpoint['processed_ids'][-max_ids:]:
+                    self.processed_ids.add(message_id)
+                    self.order.append(message_id)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Ignoring the broken youtube checkpoint {path}, the chat is read from the newest messages: {e}")
+
+    def seen(self, message_id):
+        """return True if the command of the message with the given id was already processed"""
+        return message_id in self.processed_ids
+
+    def processed(self, message_id, sent_ms):
+        """record the command of a message as processed"""
+        if message_id in self.processed_ids:
+            return
+
+        self.processed_ids.add(message_id)
+        self.order.append(message_id)
+        if len(self.order) > self.max_ids:
+            self.processed_ids.discard(self.order.popleft())
+
+        self.last_message_id = message_id
+        self.last_sent_ms = max(sent_ms, self.last_sent_ms or 0)
+        self.dirty = True
+
+    def started(self, start_ms):
+        """record the time the bot started reading the chat at, unless an earlier bot already did"""
+        if self.started_ms is None:
+            self.started_ms = start_ms
+            self.dirty = True
+
+    def advance(self, page_token):
+        """record the page token the next poll is made with"""
+        if page_token != self.page_token:
+            self.page_token = page_token
+            self.dirty = True
+
+    def save(self):
+        """write the checkpoint to its file, if anything changed since it was last saved"""
+        if not self.dirty:
+            return
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({
+                'page_token': self.page_token,
+                'started_ms': self.started_ms,
+                'last_message_id': self.last_message_id,
+                'last_sent_ms': self.last_sent_ms,
+                'processed_ids': list(self.order),
+            }, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, self.path)
+        self.dirty = False
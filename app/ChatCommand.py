@@ -0,0 +1,54 @@
+import calendar
+
+class ChatCommand:
+    """
+        A command read from the youtube chat, waiting in unread_messages of the youtube bot to be run.
+        Kept as a record with __slots__, so a waiting command is one small object with no dict of its own,
+        and the time it was sent is an int of epoch milliseconds instead of a datetime.
+    """
+    __slots__ = ('message_id', 'user_id', 'command', 'words', 'sent_ms', 'owner')
+
+    #'YYYY-MM-DD' -> epoch seconds of the midnight of that day in utc, a stream only ever sees a couple of days
+    MIDNIGHTS = {}
+
+    def __init__(self, message_id, user_id, command, words, sent_ms, owner=False):
+        """fields:
+        message_id: id of the chat message, the idempotency key of the command, see ChatCheckpoint
+        user_id: youtube channel id of the author, interned by the bot so it is kept once however many messages the author sends
+        command: the Command of the registry the message is
+        words: the words following the command
+        sent_ms: epoch time in milliseconds the message was sent at
+        owner: the author is the owner of the chat, according to youtube
+        """
+        self.message_id = message_id
+        self.user_id = user_id
+        self.command = command
+        self.words = words
+        self.sent_ms = sent_ms
+        self.owner = owner
+
+    @staticmethod
+    def epoch_millis(timestamp):
+        """return the epoch time in milliseconds of an rfc 3339 timestamp of the youtube api, like 2024-05-01T18:30:00.123456+00:00.
+        the date is looked up in MIDNIGHTS, only the time of day is parsed for every message, no datetime is made.
+        the fraction is optional, the zone is either Z, or an offset with or without a colon
+        """
+        day = timestamp[:10]
+        midnight = ChatCommand.MIDNIGHTS.get(day)
+        if midnight is None:
+            if len(ChatCommand.MIDNIGHTS) > 8:
+                ChatCommand.MIDNIGHTS.clear()
+            midnight = ChatCommand.MIDNIGHTS[day] = calendar.timegm((int(day[:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0))
+
+        seconds = midnight + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+        if timestamp[-1] == 'Z':
+            zone_start = len(timestamp) - 1
+        else:
+            zone_start = len(timestamp) - (6 if timestamp[-3] == ':' else 5)
+            offset = int(timestamp[zone_start + 1:zone_start + 3]) * 3600 + int(timestamp[-2:]) * 60
+            seconds -= offset if timestamp[zone_start] == '+' else -offset
+
+        #the fraction, if any, sits between the seconds and the zone
+        millis = int((timestamp[20:zone_start] + '00')[:3]) if zone_start > 20 else 0
+        return seconds * 1000 + millis
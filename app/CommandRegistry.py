@@ -0,0 +1,263 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+#most names of a list spelled out in a reply, the others are counted as +N more
+MAX_NAMES = 10
+
+class Command:
+    """
+        A chat command, defined once and run the same way by the bots of every platform.
+        How every exit code of the command is reported is part of its definition, as a (kind, message) pair:
+            reply: the message is sent to the chat
+            verbose: the message is sent to the chat, only if the bot is verbose
+            join: the user is announced as added to the wheel, coalesced with the other joins
+            double: the user is announced as having doubled their odds, coalesced with the others who did
+            log: the message is printed on the console of the bots
+        {user} in a message is replaced by the name of the user who sent the command. Commands can also hand back details
+        along with the exit code, as an (exit code, dict) pair, which are filled into the message the same way.
+        A list of names in the details is spelled out as "alice, bob +3 more", with as many names as fit in a message of the chat.
+    """
+    def __init__(self, name, run, results, params=(), cooldown=0, blocking=False, usage=None, privileged=False):
+        """fields:
+        name: the command without the prefix, like 'wheel' for !wheel. matched case sensitively
+        run: function(bot_manager, channel, username, *args) running the command. return value is a future of the exit code,
+             or the exit code itself if blocking is set
+        results: exit code -> (kind, message) pairs, see above. exit codes missing from it are not reported
+        params: converters of the arguments, applied in order to the words following the command. missing words are not passed,
+                so run can give them defaults, and extra words are ignored
+        cooldown: seconds a user has to wait before the command runs for them again in the same channel
+        blocking: run makes requests and blocks, so it is run on the thread pool of the registry instead of by the caller
+        usage: verbose reply sent when the arguments can't be parsed
+        privileged: only allowed users can run the command. run is given the identity of the user the bot manager authorizes,
+                    instead of the name of the user, see CommandRegistry.execute
+        """
+        self.name = name
+        self.run = run
+        self.results = results
+        self.params = params
+        self.cooldown = cooldown
+        self.blocking = blocking
+        self.usage = usage
+        self.privileged = privileged
+
+class CommandRegistry:
+    """
+        The commands the bots understand, shared by the bots of both platforms, so a command is added once and behaves the same everywhere.
+        Commands are found with a single dict lookup on the first word of a message, so plain chat is dropped cheaply.
+        Also keeps the cooldowns of the commands, per channel and user, and the rate limiter in front of them, if there is one.
+    """
+    def __init__(self, prefix='!', workers=2, limiter=None):
+        """fields:
+        prefix: text every command starts with
+        commands: dict of command name -> Command
+        last_used: (channel, username, command name) -> monotonic time the command was last run, oldest first
+        max_cooldown: longest cooldown of the registered commands, uses older than it are forgotten
+        lock: the cooldowns are checked by the bots of both platforms, from different threads
+        executor: thread pool the blocking commands are run on
+        limiter: optional RateLimiter every command has to get past before anything else is done with it
+        """
+        self.prefix = prefix
+        self.commands = {}
+        self.last_used = OrderedDict()
+        self.max_cooldown = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.limiter = limiter
+
+    def register(self, command):
+        """add a command, replacing any command with the same name"""
+        self.commands[command.name] = command
+        self.max_cooldown = max(self.max_cooldown, command.cooldown)
+
+    def parse(self, text):
+        """return the (command, argument words) pair of a chat message, None if the message is not a command"""
+        if not text.startswith(self.prefix):
+            return None
+
+        name, _, rest = text[len(self.prefix):].partition(' ')
+        command = self.commands.get(name)
+        if command is None:
+            return None
+        return command, rest.split()
+
+    def admit(self, channel, user):
+        """return True if the rate limiter lets a command of the user through, or if there is no limiter.
+        called as soon as a message is known to be a command, so a flood is dropped before any other work is done for it
+        """
+        return self.limiter is None or self.limiter.allow(channel, user)
+
+    def ready(self, command, channel, username):
+        """return True if the command is off cooldown for the user, and start its cooldown. False if it should be dropped"""
+        if not command.cooldown:
+            return True
+
+        now = time.monotonic()
+        key = (channel, username, command.name)
+        with self.lock:
+            last = self.last_used.get(key)
+            if last is not None and now - last < command.cooldown:
+                return False
+
+            self.last_used[key] = now
+            self.last_used.move_to_end(key)
+
+            #the oldest uses are at the front, drop the ones no cooldown cares about anymore
+            while self.last_used:
+                oldest = next(iter(self.last_used.values()))
+                if now - oldest < self.max_cooldown:
+                    break
+                self.last_used.popitem(last=False)
+
+        return True
+
+    def execute(self, command, bot_manager, channel, username, words, identity=None) -> Future:
+        """run a parsed command, return value is a future of its exit code. The future resolves to None if the arguments are invalid.
+        identity is who the user is to the allowed users of the bot manager, passed to privileged commands instead of the username.
+        the username itself if None, like on twitch, where the login is both
+        """
+        user = identity if command.privileged and identity is not None else username
+        try:
+            args = [convert(word) for convert, word in zip(command.params, words)]
+        except ValueError:
+            future = Future()
+            future.set_result(None)
+            return future
+
+        if command.blocking:
+            return self.executor.submit(command.run, bot_manager, channel, user, *args)
+        return command.run(bot_manager, channel, user, *args)
+
+    def respond(self, command, ret, username, replies, verbose, sent_at=None):
+        """report the exit code of a command as its results say.
+        replies is the ReplyQueue of the chat the command came from, sent_at the epoch time the command was sent at
+        """
+        details = {}
+        if isinstance(ret, tuple):
+            ret, details = ret
+
+        if ret is None:
+            kind, message = 'verbose', command.usage
+        else:
+            kind, message = command.results.get(ret, (None, None))
+
+        if message is not None:
+            message = self.__fill(message, username, details, replies.max_length)
+
+        match kind:
+            case 'reply':
+                replies.put(message, sent_at)
+            case 'verbose':
+                if verbose and message is not None:
+                    replies.put(message, sent_at, verbose=True)
+            case 'join':
+                replies.put_join(username, sent_at)
+            case 'double':
+                replies.put_double(username, sent_at)
+            case 'log':
+                print(message)
+
+    @staticmethod
+    def __fill(message, username, details, max_length):
+        """fill the user and the details into a message. the lists of names in the details are cut short,
+        down to a single name, until the message fits in max_length, if given
+        """
+        lists = {key: value for key, value in details.items() if isinstance(value, list)}
+        for shown in range(MAX_NAMES, 0, -1):
+            names = {key: ', '.join(value[:shown]) + (f' +{len(value) - shown} more' if len(value) > shown else '') for key, value in lists.items()}
+            text = message.format(user=username, **{**details, **names})
+            if not lists or max_length is None or len(text) <= max_length:
+                break
+        return text
+
+def default_registry(limiter=None):
+    """return a registry with the commands of the bots, behind the given RateLimiter if any"""
+    registry = CommandRegistry(limiter=limiter)
+
+    #!start, executable only by users in allowed_users. allows the bots to listen for users who wish to join the wheel
+    registry.register(Command('start', lambda manager, channel, user: manager.toggle_listening(channel, user, True), {
+        -2: ('verbose', 'lmao fail, dunno why'),
+        -1: ('verbose', '{user}, you are not allowed to start the bot.'),
+        0: ('reply', 'Now listening for usernames!'),
+    }, cooldown=1, privileged=True))
+
+    #!stop, executable only by users in allowed_users. disallows the bots to listen for users who wish to join the wheel
+    registry.register(Command('stop', lambda manager, channel, user: manager.toggle_listening(channel, user, False), {
+        -2: ('verbose', 'lmao fail, dunno why'),
+        -1: ('verbose', '{user}, you are not allowed to stop the bot.'),
+        0: ('reply', 'Now stopped listening for usernames!'),
+    }, cooldown=1, privileged=True))
+
+    #!odds, executable only by users in allowed_users. toggles the use permission of !here
+    registry.register(Command('odds', lambda manager, channel, user: manager.toggle_doubling(channel, user), {
+        -2: ('verbose', 'lmao fail, dunno why'),
+        -1: ('verbose', '{user}, you are not allowed to allow the doubling.'),
+        0: ('reply', 'Doubling your odds is now disallowed!'),
+        1: ('reply', 'Doubling your odds is now allowed!'),
+    }, cooldown=1, privileged=True))
+
+    #!wheel, executable by users only after !start. adds the user to the wheel, if not already present
+    registry.register(Command('wheel', lambda manager, channel, user: manager.add_username_to_wheel(channel, user), {
+        -3: ('verbose', '{user}, the bot is not currently listening for usernames.'),
+        -2: ('verbose', 'Reached the maximum number of users. Stopping collection.'),
+        -1: ('verbose', '{user}, you are already on the wheel!'),
+        0: ('join', None),
+    }, cooldown=1))
+
+    #!here, executable only after !odds and while the bots are not listening, so before !start.
+    #doubles the odds of the user if and only if the user is on the wheel and didn't use this command before
+    registry.register(Command('here', lambda manager, channel, user: manager.double_odds(channel, user), {
+        -4: ('verbose', 'doubling odds is not allowed during active listening.'),
+        -3: ('verbose', 'doubling odds is not allowed right now.'),
+        -2: ('verbose', '{user}, you already doubled your odds once'),
+        -1: ('verbose', '{user}, you are not a member of the previos wheel!'),
+        0: ('double', None),
+    }, cooldown=1))
+
+    #!getWheel, executable only by users in allowed_users. uploads the wheel of the channel to a private wheel on wheel of names,
+    #the wheel with the wheel name of the channel is updated if it exists, otherwise it is created. the upload blocks
+    registry.register(Command('getWheel', lambda manager, channel, user: manager.create_wheel(channel, user), {
+        -2: ('log', 'Failed to create the wheel. Please try again later.'),
+        -1: ('verbose', '{user}, you are not allowed to create a wheel.'),
+        0: ('log', 'wheel created! go check it out in your account!'),
+    }, cooldown=5, blocking=True, privileged=True))
+
+    #!loadWheel, executable only by users in allowed_users. replaces the wheel of the channel with the users of the wheel
+    #with the wheel name of the channel on wheel of names. the download blocks
+    registry.register(Command('loadWheel', lambda manager, channel, user: manager.load_wheel(channel, user), {
+        -2: ('log', 'Failed to load the wheel. Please try again later.'),
+        -1: ('verbose', '{user}, you are not allowed to load a wheel.'),
+        0: ('log', 'Users on Wheel has been loaded!'),
+    }, cooldown=5, blocking=True, privileged=True))
+
+    #!draw [winners] [seed], executable only by users in allowed_users and while the bots are not listening.
+    #draws winners from the wheel without wheel of names, weighted by their entries. the seed is random unless given
+    registry.register(Command('draw', lambda manager, channel, user, count=1, seed=None: manager.draw(channel, user, count, seed), {
+        -4: ('verbose', 'there is nobody on the wheel to draw from.'),
+        -3: ('verbose', 'usage: !draw [number of winners] [seed]'),
+        -2: ('verbose', 'drawing is not allowed during active listening.'),
+        -1: ('verbose', '{user}, you are not allowed to draw.'),
+        0: ('reply', 'The wheel has spoken: {winners}! (seed {seed})'),
+    }, params=(int, str), cooldown=5, blocking=True, usage='usage: !draw [number of winners] [seed]', privileged=True))
+
+    #!exportWheel [binary|jsonl], executable only by users in allowed_users. writes the wheel of the channel, along with who
+    #doubled their odds, to its archive in the archive_dir of the config. binary unless jsonl is given. the write blocks
+    registry.register(Command('exportWheel', lambda manager, channel, user, archive_format='binary': manager.export_wheel(channel, user, archive_format), {
+        -3: ('verbose', 'usage: !exportWheel [binary|jsonl], needs an archive_dir in the config'),
+        -2: ('log', 'Failed to export the wheel.'),
+        -1: ('verbose', '{user}, you are not allowed to export the wheel.'),
+        0: ('log', 'exported {entrants} users to {file}'),
+    }, params=(str,), cooldown=5, blocking=True, privileged=True))
+
+    #!importWheel [binary|jsonl], executable only by users in allowed_users and while the bots are not listening.
+    #replaces the wheel of the channel with its archive in the archive_dir of the config. the read blocks
+    registry.register(Command('importWheel', lambda manager, channel, user, archive_format='binary': manager.import_wheel(channel, user, archive_format), {
+        -4: ('log', 'Failed to import the wheel, the archive is missing or invalid.'),
+        -3: ('verbose', 'usage: !importWheel [binary|jsonl], needs an archive_dir in the config'),
+        -2: ('verbose', 'importing a wheel is not allowed during active listening.'),
+        -1: ('verbose', '{user}, you are not allowed to import a wheel.'),
+        0: ('log', 'imported {entrants} users onto the wheel!'),
+    }, params=(str,), cooldown=5, blocking=True, privileged=True))
+
+    return registry
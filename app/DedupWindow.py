@@ -0,0 +1,49 @@
+from collections import deque
+
+class DedupWindow:
+    """
+        Sliding window for suppressing repeated messages.
+        A key is a duplicate if the same key was accepted less than interval ago.
+        Accepted keys are kept in arrival order, so expiring and evicting always drops the oldest ones first.
+    """
+    def __init__(self, max_size, interval):
+        """fields:
+        max_size: maximum amount of keys remembered, the oldest key is evicted past this
+        interval: minimum time between two accepted occurences of the same key,
+                  has to be the same type as the difference of two of the times passed to accept
+        last_seen: dict of key -> time it was last accepted, for constant time lookups
+        order: double-ended queue of (time, key) pairs in the order they were accepted
+        """
+        self.max_size = max_size
+        self.interval = interval
+        self.last_seen = {}
+        self.order = deque()
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def __drop_oldest(self):
+        """remove the oldest accepted key, unless it has been accepted again since"""
+        time, key = self.order.popleft()
+        if self.last_seen.get(key) == time:
+            del self.last_seen[key]
+
+    def accept(self, key, time):
+        """check a key that arrived at the given time against the window
+        return value is True if the key is new or its last occurence is old enough, False if it is a duplicate
+        """
+        #anything older than interval can no longer make a key a duplicate
+        while self.order and time - self.order[0][0] >= self.interval:
+            self.__drop_oldest()
+
+        last_time = self.last_seen.get(key)
+        if last_time is not None and time - last_time < self.interval:
+            return False
+
+        self.last_seen[key] = time
+        self.order.append((time, key))
+
+        if len(self.order) > self.max_size:
+            self.__drop_oldest()
+
+        return True
@@ -0,0 +1,74 @@
+import random
+import hashlib
+
+class DrawEngine:
+    """
+        Weighted draw of winners from the entrants of a wheel, without wheel of names.
+        The weights are kept in a fenwick tree, so picking a winner and taking them out of the following picks are both O(log n),
+        and building it is O(n). Winners are drawn without replacement.
+        Draws are seeded: the same entrants, in the same order, and the same seed always give the same winners,
+        so a draw can be checked afterwards against the fingerprint of the entrants it was made from.
+    """
+    def __init__(self, usernames):
+        """fields:
+        names: the usernames, in the order of the wheel
+        weights: weight of every username still in the draw, 0 once drawn
+        tree: fenwick tree of the weights, 1-indexed, tree[i] is the sum of the weights of the range of names ending at i
+        total: sum of the weights still in the draw
+        top: highest power of two not over the amount of names, where the search of the tree starts
+        """
+        self.names = list(usernames)
+        self.weights = list(usernames.values())
+        self.total = sum(self.weights)
+
+        n = len(self.weights)
+        self.tree = [0] + self.weights
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self.tree[parent] += self.tree[i]
+
+        self.top = 1 << (n.bit_length() - 1) if n else 0
+
+    @staticmethod
+    def fingerprint(usernames):
+        """return the sha256 of the weighted usernames in order, identifies the exact wheel a draw was made from"""
+        digest = hashlib.sha256()
+        for user, weight in usernames.items():
+            digest.update(f'{user}\t{weight}\n'.encode())
+        return digest.hexdigest()
+
+    def __find(self, target):
+        """return the index of the name whose weight range holds target, 0 <= target < total"""
+        pos = 0
+        step = self.top
+        while step:
+            next_pos = pos + step
+            if next_pos < len(self.tree) and self.tree[next_pos] <= target:
+                pos = next_pos
+                target -= self.tree[next_pos]
+            step >>= 1
+        return pos
+
+    def __remove(self, index):
+        """take a name out of the following picks"""
+        weight = self.weights[index]
+        self.weights[index] = 0
+        self.total -= weight
+
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] -= weight
+            i += i & -i
+
+    def draw(self, count, seed):
+        """draw up to count winners without replacement, every pick weighted by the weight of the names left.
+        return value is the list of winners in the order they were drawn, shorter than count if the names ran out
+        """
+        rng = random.Random(seed)
+        winners = []
+        while len(winners) < count and self.total > 0:
+            index = self.__find(rng.randrange(self.total))
+            winners.append(self.names[index])
+            self.__remove(index)
+        return winners
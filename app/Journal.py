@@ -0,0 +1,104 @@
+import os
+import json
+
+class Journal:
+    """
+        Append-only journal of the changes made to the wheel, so the wheel survives a crash or restart.
+        Every change is written as one json line, and every compact_every changes the whole wheel is written to a snapshot
+        and the journal is started over. On startup the snapshot is loaded and the journal is replayed on top of it.
+        Each change carries a sequence number, so changes already in the snapshot are never applied twice,
+        even if the process died between writing a snapshot and clearing the journal.
+    """
+    def __init__(self, directory, compact_every=1000):
+        """fields:
+        journal_path and snapshot_path: files kept in the given directory, which is created if missing
+        compact_every: amount of journaled changes after which a snapshot is written
+        seq: sequence number of the last change written
+        pending: changes written since the last snapshot
+        file: the journal, opened for appending
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, 'wheel.journal')
+        self.snapshot_path = os.path.join(directory, 'wheel.snapshot')
+        self.compact_every = compact_every
+        self.seq = 0
+        self.pending = 0
+        self.file = None
+
+    def replay(self):
+        """load the wheel from the snapshot and the journal, and open the journal for appending.
+        return value is the (usernames, doubled_odds_usernames) pair of the restored wheel, empty if nothing was saved yet
+        """
+        usernames = {}
+        doubled = set()
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.seq = snapshot['seq']
+            usernames = snapshot['usernames']
+            doubled = set(snapshot['doubled'])
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal_file:
+                for line in journal_file:
+                    try:
+                        seq, op, arg = json.loads(line)
+                    except ValueError:
+                        #a line cut short by a crash is the last one, nothing after it was written
+                        break
+
+                    if seq <= self.seq:
+                        continue
+                    self.seq = seq
+                    self.pending += 1
+
+                    if op == 'join':
+                        usernames[arg] = 1
+                    elif op == 'double':
+                        usernames[arg] *= 2
+                        doubled.add(arg)
+                    elif op == 'load':
+                        usernames = arg
+
+        #a cut short line would break every line appended after it, start from a clean journal instead
+        self.compact(usernames, doubled)
+        return usernames, doubled
+
+    def __append(self, op, arg):
+        self.seq += 1
+        self.pending += 1
+        self.file.write(json.dumps([self.seq, op, arg]) + '\n')
+        self.file.flush()
+
+    def join(self, username):
+        """record a user added to the wheel"""
+        self.__append('join', username)
+
+    def double(self, username):
+        """record a user who doubled their odds"""
+        self.__append('double', username)
+
+    def load(self, usernames):
+        """record the wheel being replaced by a loaded one"""
+        self.__append('load', usernames)
+
+    def should_compact(self):
+        """return True once enough changes were journaled to write a snapshot"""
+        return self.pending >= self.compact_every
+
+    def compact(self, usernames, doubled):
+        """write the whole wheel to the snapshot and start the journal over.
+        the snapshot is written to a temporary file first and swapped in, so there is always one complete snapshot on disk
+        """
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump({'seq': self.seq, 'usernames': usernames, 'doubled': list(doubled)}, snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.journal_path, 'w')
+        self.pending = 0
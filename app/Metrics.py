@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Metrics:
+    """
+        Registry of the counters, gauges and summaries the bots record, in the spirit of prometheus_client but dependency free.
+        Every metric is identified by a name and a set of labels, like platform="twitch".
+        The registry can be served as prometheus text over http, or dumped to a json file periodically.
+    """
+    def __init__(self, samples=1024):
+        """fields:
+        counters: (name, labels) -> value of counters that only go up
+        gauges: (name, labels) -> value, or function returning the value when the metrics are collected
+        summaries: (name, labels) -> [count, sum, recent observations], the recent observations are used for the quantiles
+        samples: amount of recent observations kept per summary
+        started: time the registry was created
+        lock: metrics are recorded from the threads of both bots, the bot manager and the reply queues
+        """
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self.samples = samples
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """increase a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        """set a gauge to a value, or to a function that is called for the value whenever the metrics are collected"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """record an observation of a summary, like the duration of a call"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is None:
+                summary = self.summaries[key] = [0, 0.0, deque(maxlen=self.samples)]
+            summary[0] += 1
+            summary[1] += value
+            summary[2].append(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """observe the time spent in the with block, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def __quantile(sorted_values, q):
+        return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+    def collect(self):
+        """return a snapshot of every metric as a list of (name, labels, value) samples, summaries expanded into quantiles"""
+        with self.lock:
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+            summaries = [(key, count, total, sorted(recent)) for key, (count, total, recent) in self.summaries.items()]
+
+        samples = [('uptime_seconds', (), time.time() - self.started)]
+        samples += [(name, labels, value) for (name, labels), value in counters]
+
+        for (name, labels), value in gauges:
+            try:
+                samples.append((name, labels, value() if callable(value) else value))
+            except Exception:
+                continue
+
+        for (name, labels), count, total, recent in summaries:
+            for q in (0.5, 0.99):
+                if recent:
+                    samples.append((name, labels + (('quantile', str(q)),), self.__quantile(recent, q)))
+            samples.append((f'{name}_sum', labels, total))
+            samples.append((f'{name}_count', labels, count))
+
+        return samples
+
+    def render(self):
+        """return the metrics in the prometheus text exposition format"""
+        lines = []
+        for name, labels, value in self.collect():
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f'{name}{{{label_text}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def as_dict(self):
+        """return the metrics as a json friendly dict of name -> list of {labels, value}"""
+        result = {}
+        for name, labels, value in self.collect():
+            result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        return result
+
+    def serve(self, port, host='127.0.0.1'):
+        """serve the metrics in the prometheus text format on http://host:port/metrics, from a thread of its own"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def start_dump(self, path, interval):
+        """write the metrics to a json file every interval seconds, from a thread of its own.
+        the file is replaced at once, so readers never see a half written dump
+        """
+        def dump():
+            while True:
+                time.sleep(interval)
+                temp_path = path + '.tmp'
+                with open(temp_path, 'w') as dump_file:
+                    json.dump({'time': time.time(), 'metrics': self.as_dict()}, dump_file)
+                os.replace(temp_path, path)
+
+        threading.Thread(target=dump, daemon=True).start()
+
+#the registry shared by all the bots
+metrics = Metrics()
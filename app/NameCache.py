@@ -0,0 +1,46 @@
+import time
+from collections import OrderedDict
+
+class NameCache:
+    """
+        Bounded cache for usernames, keyed by the youtube channel id of the author.
+        Least recently used entries are evicted once max_size is reached, and entries older than ttl seconds are treated as missing,
+        so renamed channels get picked up eventually.
+    """
+    def __init__(self, max_size, ttl):
+        """fields:
+        max_size: maximum amount of names kept in the cache
+        ttl: time in seconds a cached name stays valid
+        entries: ordered dict of channel id -> (name, time of insertion), ordered from least to most recently used
+        hits and misses: counters of the lookups that were and weren't answered from the cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """return the cached name for key, or None if it is not cached or has expired"""
+        entry = self.entries.get(key)
+
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, name):
+        """cache a name for key, evicting the least recently used entry if the cache is full"""
+        self.entries[key] = (name, time.monotonic())
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        """return the fraction of lookups answered from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
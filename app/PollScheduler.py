@@ -0,0 +1,54 @@
+import random
+
+class PollScheduler:
+    """
+        Decides how long the youtube bot waits before polling the chat again.
+        The polling interval youtube asks for is honored, minus the time the last cycle already took.
+        While names aren't being collected, polling slows down to idle_interval to save quota.
+        Failed polls back off exponentially with jitter, starting higher for quota errors, which don't clear up quickly.
+    """
+    def __init__(self, default_interval=5, idle_interval=10, backoff=2, quota_backoff=60, max_backoff=900):
+        """fields, all times are in seconds:
+        default_interval: interval used until youtube has told us one
+        idle_interval: minimum interval while names aren't being collected
+        backoff and quota_backoff: wait after the first failed poll, and after the first quota error
+        max_backoff: upper limit of the wait after repeated failures
+        server_interval: the last interval youtube asked for with pollingIntervalMillis, None if unknown
+        failures: amount of failed polls in a row
+        quota_exceeded: True if the last failure was a quota error
+        """
+        self.default_interval = default_interval
+        self.idle_interval = idle_interval
+        self.backoff = backoff
+        self.quota_backoff = quota_backoff
+        self.max_backoff = max_backoff
+        self.server_interval = None
+        self.failures = 0
+        self.quota_exceeded = False
+
+    def success(self, polling_interval_millis):
+        """record a successful poll, along with the polling interval returned by it"""
+        self.server_interval = polling_interval_millis / 1000 if polling_interval_millis else None
+        self.failures = 0
+        self.quota_exceeded = False
+
+    def failure(self, quota_exceeded=False):
+        """record a failed poll"""
+        self.failures += 1
+        self.quota_exceeded = quota_exceeded
+
+    def next_delay(self, elapsed, active):
+        """return the time in seconds to wait before the next poll.
+        elapsed is the time the last cycle took, active tells if names are being collected right now
+        """
+        if self.failures:
+            base = self.quota_backoff if self.quota_exceeded else self.backoff
+            delay = min(self.max_backoff, base * 2 ** (self.failures - 1))
+            #full jitter in the upper half, so bots of multiple streams don't retry in lockstep
+            return random.uniform(delay / 2, delay)
+
+        interval = self.server_interval or self.default_interval
+        if not active:
+            interval = max(interval, self.idle_interval)
+
+        return max(0, interval - elapsed)
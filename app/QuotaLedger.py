@@ -0,0 +1,104 @@
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+    QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+except Exception:
+    #no timezone database available, pacific standard time is close enough
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+#quota units each youtube data api call costs, see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'liveBroadcasts.list': 1,
+    'channels.list': 1,
+    'liveChatMessages.list': 5,
+    'liveChatMessages.streamList': 5,
+    'liveChatMessages.insert': 50,
+}
+
+class QuotaLedger:
+    """
+        Keeps track of the daily youtube data api quota used by the youtube bots, which all share the quota of one project.
+        The quota resets at midnight pacific time. From the rate the quota is used at, the ledger forecasts when it runs out,
+        and degrades the bots as the budget shrinks: first verbose replies are dropped, then polling slows down
+        so the rest of the budget lasts until the reset.
+    """
+    def __init__(self, daily_budget=10000, quiet_below=0.5, slow_below=0.2):
+        """fields:
+        daily_budget: quota units available per day
+        quiet_below: fraction of the budget left under which verbose replies are dropped
+        slow_below: fraction of the budget left under which polling is slowed down
+        used: quota units used today
+        calls: counter of the calls made today, by call type
+        day: the pacific date the counts belong to
+        day_start: monotonic time of the first call of the day, the usage rate is measured from there
+        lock: the ledger is shared by the bots of all livestreams
+        """
+        self.daily_budget = daily_budget
+        self.quiet_below = quiet_below
+        self.slow_below = slow_below
+        self.used = 0
+        self.calls = Counter()
+        self.day = None
+        self.day_start = None
+        self.lock = threading.Lock()
+
+    def __roll_over(self):
+        """start counting from zero once the quota has been reset"""
+        today = datetime.now(QUOTA_TIMEZONE).date()
+        if today != self.day:
+            self.day = today
+            self.day_start = time.monotonic()
+            self.used = 0
+            self.calls.clear()
+
+    def record(self, call):
+        """record a call to the api, call is one of the keys of QUOTA_COSTS"""
+        with self.lock:
+            self.__roll_over()
+            self.used += QUOTA_COSTS[call]
+            self.calls[call] += 1
+
+    def remaining(self):
+        """return the quota units left for today"""
+        with self.lock:
+            self.__roll_over()
+            return max(0, self.daily_budget - self.used)
+
+    def __fraction_left(self):
+        return self.remaining() / self.daily_budget
+
+    def seconds_until_reset(self):
+        """return the time in seconds until the quota resets"""
+        now = datetime.now(QUOTA_TIMEZONE)
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=QUOTA_TIMEZONE)
+        return (midnight - now).total_seconds()
+
+    def forecast(self):
+        """return the time in seconds until the quota runs out at the current rate of use, None if nothing was used yet"""
+        remaining = self.remaining()
+        with self.lock:
+            elapsed = time.monotonic() - self.day_start
+            if not self.used or not elapsed:
+                return None
+            return remaining / (self.used / elapsed)
+
+    def verbose_allowed(self):
+        """return False once the budget is low enough that only essential replies should be sent"""
+        return self.__fraction_left() > self.quiet_below
+
+    def poll_slowdown(self):
+        """return the factor to stretch the polling interval by.
+        1 while the budget is healthy, otherwise enough to make the rest of the budget last until the reset
+        """
+        if self.__fraction_left() > self.slow_below:
+            return 1
+
+        time_left = self.forecast()
+        if time_left is None:
+            return 1
+        #out of quota, every poll is wasted until the reset. the caller caps the wait at the reset
+        return max(2, self.seconds_until_reset() / max(time_left, 1))
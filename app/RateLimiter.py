@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+from TokenBucket import TokenBucket
+from Metrics import metrics
+
+class RateLimiter:
+    """
+        Flood control in front of the command dispatch of both bots.
+        Every user has a token bucket of their own, and all users share a global one. The first command of a user is always let through,
+        so a raid of viewers joining the wheel is never slowed down. Commands of users seen before need a token from both buckets,
+        and are shed while the backlog of the bot manager is over max_backlog.
+        A dropped command costs a dict lookup and a bucket update, it never reaches the bot manager or an api call.
+    """
+    def __init__(self, user_rate=0.5, user_burst=3, global_rate=100, global_burst=200, max_backlog=1000, backlog=None,
+                 max_users=50000, exempt=()):
+        """fields:
+        user_rate and user_burst: commands per second a user can sustain, and the amount they can send at once
+        global_bucket: token bucket shared by all users, global_rate is in commands per second and global_burst the amount at once
+        max_backlog: commands waiting for the bot manager, over which the commands of users seen before are shed
+        backlog: function returning the current backlog, like BotManager.backlog. Nothing is shed for the backlog if None
+        users: (channel, user) -> token bucket of the user, least recently active first
+        max_users: amount of users remembered, the least recently active are forgotten first
+        exempt: (channel, user) pairs of the users who are never limited in a channel, like its privilaged users.
+                the channel lowercased, the user as the bots key them: twitch logins, youtube channel ids
+        lock: the limiter is shared by the bots of both platforms, from different threads
+        """
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_backlog = max_backlog
+        self.backlog = backlog
+        self.users = OrderedDict()
+        self.max_users = max_users
+        self.exempt = frozenset(exempt)
+        self.lock = threading.Lock()
+
+    def allow(self, channel, user):
+        """return True if a command of user in channel should be run, False if it should be dropped.
+        user is whatever identifies the user on their platform, like the twitch name or the youtube channel id
+        """
+        if self.exempt and (channel.lower(), user) in self.exempt:
+            return True
+
+        key = (channel, user)
+        with self.lock:
+            bucket = self.users.get(key)
+            if bucket is None:
+                bucket = self.users[key] = TokenBucket(self.user_rate, self.user_burst)
+                bucket.try_take()
+                if len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+                return True
+
+            self.users.move_to_end(key)
+            if not bucket.try_take():
+                reason = 'user'
+            elif self.backlog is not None and self.backlog() > self.max_backlog:
+                reason = 'backlog'
+            elif not self.global_bucket.try_take():
+                reason = 'global'
+            else:
+                return True
+
+        metrics.inc('commands_shed_total', reason=reason)
+        return False
@@ -0,0 +1,180 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from TokenBucket import TokenBucket
+from Metrics import metrics
+
+#the coalesced announcements, in the order they are sent: kind -> (message for one name, end of the message for several)
+ANNOUNCEMENTS = {
+    'join': ('{} has been added to the wheel!', 'were added to the wheel!'),
+    'double': ('{}, your chances have been doubled!', 'doubled their chances!'),
+}
+
+class ReplyQueue:
+    """
+        Outbound chat reply queue, shared by both bots.
+        Replies are sent from a worker thread, so the command path only appends to a queue and never waits on the platform.
+        Sending is rate limited by a token bucket, and while the bucket is empty, the names of users who joined the wheel
+        pile up and are sent as a single message, like "alice, bob, carol +12 more were added to the wheel!".
+        The same goes for the users who doubled their odds, see ANNOUNCEMENTS.
+        Replies go first, then the announcements, verbose replies only when nothing else waits, so a flood of them can't hold up the rest.
+        Verbose replies are capped, repeats of one already waiting are dropped, and so are the ones that waited too long to still matter.
+    """
+    def __init__(self, send, rate, burst, max_names=3, loop=None, platform=None, max_verbose=20, verbose_ttl=30, max_length=None):
+        """fields:
+        send: function that sends a message to the chat. If loop is given, it is a coroutine function that is run on that loop
+        loop: the event loop the replies are sent on, None if send is a blocking function
+        bucket: token bucket limiting how often a reply is sent, rate is in messages per second and burst the amount sent at once
+        max_names: maximum amount of names spelled out in a coalesced announcement
+        platform: label of the chat platform for the recorded metrics
+        max_length: most characters a message of the chat can hold, longer replies are cut short to it. None if there is no limit
+        messages: double-ended queue of (reply, time the command was sent) pairs waiting to be sent
+        announcements: dict of kind of ANNOUNCEMENTS -> (name, time the command was sent) pairs of the users waiting to be announced
+        verbose: double-ended queue of (reply, time the command was sent, monotonic time it was queued) of the verbose replies waiting.
+                 holds at most max_verbose of them, the oldest is dropped for a new one
+        verbose_waiting: the texts of the verbose replies in verbose, to drop repeats of them
+        verbose_ttl: seconds a verbose reply may wait, it is dropped once it waited longer
+        sending: True while the worker is sending a message
+        condition: guards messages, announcements, verbose and sending, and wakes up the worker when something is queued
+        """
+        self.send = send
+        self.loop = loop
+        self.bucket = TokenBucket(rate, burst)
+        self.max_names = max_names
+        self.platform = platform
+        self.max_length = max_length
+        self.messages = deque()
+        self.announcements = {kind: [] for kind in ANNOUNCEMENTS}
+        self.verbose = deque()
+        self.verbose_waiting = set()
+        self.max_verbose = max_verbose
+        self.verbose_ttl = verbose_ttl
+        self.sending = False
+        self.condition = threading.Condition()
+
+        self.worker = threading.Thread(target=self.__run, daemon=True)
+        self.worker.start()
+
+    def put(self, message, sent_at=None, verbose=False):
+        """queue a reply to be sent. sent_at is the epoch time of the chat message replied to,
+        if given, the time from it until the reply is sent is recorded as the reply latency.
+        verbose replies, like the ones turning a command down, are sent after everything else and may be dropped
+        """
+        with self.condition:
+            if not verbose:
+                self.messages.append((message, sent_at))
+            elif message in self.verbose_waiting:
+                metrics.inc('replies_dropped_total', platform=self.platform, reason='repeat')
+                return
+            else:
+                if len(self.verbose) >= self.max_verbose:
+                    self.__drop_verbose('full')
+                self.verbose.append((message, sent_at, time.monotonic()))
+                self.verbose_waiting.add(message)
+            self.condition.notify()
+
+    def __drop_verbose(self, reason):
+        """drop the oldest waiting verbose reply, only called with the condition held"""
+        message, _, _ = self.verbose.popleft()
+        self.verbose_waiting.discard(message)
+        metrics.inc('replies_dropped_total', platform=self.platform, reason=reason)
+
+    def put_join(self, username, sent_at=None):
+        """queue the announcement of a user added to the wheel, to be coalesced with the others"""
+        self.__announce('join', username, sent_at)
+
+    def put_double(self, username, sent_at=None):
+        """queue the announcement of a user who doubled their odds, to be coalesced with the others"""
+        self.__announce('double', username, sent_at)
+
+    def __announce(self, kind, username, sent_at):
+        with self.condition:
+            self.announcements[kind].append((username, sent_at))
+            self.condition.notify()
+
+    def __waiting(self):
+        """return True if anything is queued, only called with the condition held"""
+        return bool(self.messages or self.verbose or any(self.announcements.values()))
+
+    def idle(self):
+        """return True if every queued reply has been sent"""
+        with self.condition:
+            return not self.__waiting() and not self.sending
+
+    def __announcement(self, kind, names):
+        """build one message announcing all given names"""
+        one, several = ANNOUNCEMENTS[kind]
+        if len(names) == 1:
+            return one.format(names[0])
+
+        shown = ', '.join(names[:self.max_names])
+        if len(names) > self.max_names:
+            return f'{shown} +{len(names) - self.max_names} more {several}'
+        return f'{shown} {several}'
+
+    def __next_message(self):
+        """take the next message to send, only called by the worker once something is queued.
+        plain replies go first, the announcements of each kind collected so far are then sent as one message, and the verbose replies last.
+        return value is the message, and the times the commands it answers were sent at, None if only stale verbose replies were left
+        """
+        with self.condition:
+            self.sending = True
+            if self.messages:
+                message, sent_at = self.messages.popleft()
+                return message, [sent_at]
+
+            for kind, waiting in self.announcements.items():
+                if waiting:
+                    self.announcements[kind] = []
+                    return self.__announcement(kind, [name for name, _ in waiting]), [sent_at for _, sent_at in waiting]
+
+            stale = time.monotonic() - self.verbose_ttl
+            while self.verbose and self.verbose[0][2] < stale:
+                self.__drop_verbose('stale')
+            if not self.verbose:
+                return None
+
+            message, sent_at, _ = self.verbose.popleft()
+            self.verbose_waiting.discard(message)
+            return message, [sent_at]
+
+    def __run(self):
+        """worker loop, waits for a token before taking the next message so announcements keep piling up in the meantime"""
+        while True:
+            with self.condition:
+                while not self.__waiting():
+                    self.condition.wait()
+
+            while self.bucket.wait_time() > 0:
+                time.sleep(self.bucket.wait_time())
+
+            #the token is only taken for a message that is sent, not when the stale verbose replies were all that was left
+            next_message = self.__next_message()
+            if next_message is None:
+                with self.condition:
+                    self.sending = False
+                continue
+
+            self.bucket.try_take()
+            message, sent_times = next_message
+            if self.max_length is not None and len(message) > self.max_length:
+                message = message[:self.max_length - 3] + '...'
+            try:
+                if self.loop is not None:
+                    asyncio.run_coroutine_threadsafe(self.send(message), self.loop).result()
+                else:
+                    self.send(message)
+            except Exception as e:
+                metrics.inc('replies_failed_total', platform=self.platform)
+                print(f"Failed to send a reply to the chat: {e}")
+                continue
+            finally:
+                with self.condition:
+                    self.sending = False
+
+            metrics.inc('replies_sent_total', platform=self.platform)
+            now = time.time()
+            for sent_at in sent_times:
+                if sent_at is not None:
+                    metrics.observe('reply_latency_seconds', now - sent_at, platform=self.platform)
@@ -0,0 +1,132 @@
+class SharedWheelState:
+    """
+        Wheel of one channel kept in a database shared by the bots of multiple processes, a SqliteStore or a PostgresStore.
+        Has the same methods as WheelState, with the same exit codes, every one of them is a single transaction.
+        The sql is written for both databases, with ? placeholders, and every transaction that reads the wheel before changing it
+        locks its row first, so check-then-change operations like joining stay atomic across processes and hosts.
+    """
+    def __init__(self, store, channel, wheel_name, wheel_sync):
+        """fields:
+        store: the SqliteStore or PostgresStore the wheel is kept in
+        channel, wheel_name, wheel_sync and sync_requested: as in WheelState, the last two are local to this process
+        """
+        self.store = store
+        self.channel = channel
+        self.wheel_name = wheel_name
+        self.wheel_sync = wheel_sync
+        self.sync_requested = False
+
+    def __flags(self, db):
+        #LOCK_ROW keeps the other processes off the wheel until the transaction ends, where the store doesn't lock the whole database already
+        return db.execute('SELECT listening, doubling_allowed, version, size FROM wheels WHERE channel = ?' + self.store.LOCK_ROW,
+                          (self.channel,)).fetchone()
+
+    def __changed(self, db, size_change=0):
+        db.execute('UPDATE wheels SET version = version + 1, size = size + ? WHERE channel = ?', (size_change, self.channel))
+
+    def is_listening(self):
+        return bool(self.store.query('SELECT listening FROM wheels WHERE channel = ?', (self.channel,))[0])
+
+    def set_listening(self, toggle):
+        with self.store.transaction() as db:
+            db.execute('UPDATE wheels SET listening = ? WHERE channel = ?', (int(toggle), self.channel))
+
+    def toggle_doubling(self):
+        """flip doubling_allowed, return value is the new value"""
+        with self.store.transaction() as db:
+            db.execute('UPDATE wheels SET doubling_allowed = 1 - doubling_allowed WHERE channel = ?', (self.channel,))
+            return bool(self.__flags(db)[1])
+
+    def size(self):
+        """return the amount of usernames on the wheel"""
+        return self.store.query('SELECT size FROM wheels WHERE channel = ?', (self.channel,))[0]
+
+    def join(self, username, max_users) -> int:
+        """add a username to the wheel, exit codes are the ones of BotManager.add_username_to_wheel"""
+        with self.store.transaction() as db:
+            listening, _, _, size = self.__flags(db)
+            if not listening:
+                return -3
+
+            if size >= max_users:
+                return -2
+
+            if db.execute('INSERT INTO entrants (channel, username, weight) VALUES (?, ?, 1) ON CONFLICT DO NOTHING',
+                          (self.channel, username)).rowcount == 0:
+                return -1
+
+            self.__changed(db, 1)
+            return 0
+
+    def double(self, username) -> int:
+        """double the weight of a username, exit codes are the ones of BotManager.double_odds"""
+        with self.store.transaction() as db:
+            listening, doubling_allowed, _, _ = self.__flags(db)
+            if listening:
+                return -4
+
+            if not doubling_allowed:
+                return -3
+
+            if db.execute('SELECT 1 FROM doubled WHERE channel = ? AND username = ?', (self.channel, username)).fetchone():
+                return -2
+
+            if db.execute('UPDATE entrants SET weight = weight * 2 WHERE channel = ? AND username = ?',
+                          (self.channel, username)).rowcount == 0:
+                return -1
+
+            db.execute('INSERT INTO doubled (channel, username) VALUES (?, ?)', (self.channel, username))
+            self.__changed(db)
+            return 0
+
+    def snapshot(self, synced_version, while_listening=False):
+        """copy the wheel to upload, along with its version. None if the bots are listening, unless while_listening is set.
+        the usernames are None, instead of a copy, if synced_version, the version the remote wheel holds, is already the current one
+        """
+        with self.store.transaction() as db:
+            listening, _, version, _ = self.__flags(db)
+            if listening and not while_listening:
+                return None
+
+            if version == synced_version:
+                return None, version
+            rows = db.execute('SELECT username, weight FROM entrants WHERE channel = ? ORDER BY id', (self.channel,))
+            return dict(rows), version
+
+    def replace(self, usernames):
+        """replace the wheel with the given weighted usernames of a loaded wheel.
+        return value is the new version, None if the bots started listening in the meantime and nothing was replaced
+        """
+        with self.store.transaction() as db:
+            if self.__flags(db)[0]:
+                return None
+
+            db.execute('DELETE FROM entrants WHERE channel = ?', (self.channel,))
+            db.executemany('INSERT INTO entrants (channel, username, weight) VALUES (?, ?, ?)',
+                           ((self.channel, user, weight) for user, weight in usernames.items()))
+            db.execute('UPDATE wheels SET version = version + 1, size = ? WHERE channel = ?', (len(usernames), self.channel))
+            return self.__flags(db)[2]
+
+    def entries(self):
+        """copy the whole wheel for an export, return value is the (usernames, doubled_odds_usernames) pair"""
+        with self.store.transaction() as db:
+            rows = db.execute('SELECT username, weight FROM entrants WHERE channel = ? ORDER BY id', (self.channel,))
+            usernames = dict(rows)
+            doubled = {row[0] for row in db.execute('SELECT username FROM doubled WHERE channel = ?', (self.channel,))}
+            return usernames, doubled
+
+    def restore(self, usernames, doubled):
+        """replace the wheel, and who doubled their odds on it, with an imported wheel.
+        return value is the new version, None if the bots are listening and nothing was replaced
+        """
+        with self.store.transaction() as db:
+            if self.__flags(db)[0]:
+                return None
+
+            db.execute('DELETE FROM entrants WHERE channel = ?', (self.channel,))
+            db.execute('DELETE FROM doubled WHERE channel = ?', (self.channel,))
+            db.executemany('INSERT INTO entrants (channel, username, weight) VALUES (?, ?, ?)',
+                           ((self.channel, user, weight) for user, weight in usernames.items()))
+            db.executemany('INSERT INTO doubled (channel, username) VALUES (?, ?)', ((self.channel, user) for user in doubled))
+            db.execute('UPDATE wheels SET version = version + 1, size = ? WHERE channel = ?', (len(usernames), self.channel))
+            return self.__flags(db)[2]
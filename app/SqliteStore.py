@@ -0,0 +1,84 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from SharedWheelState import SharedWheelState
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wheels (
+    channel TEXT PRIMARY KEY,
+    listening INTEGER NOT NULL DEFAULT 0,
+    doubling_allowed INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entrants (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    username TEXT NOT NULL,
+    weight INTEGER NOT NULL,
+    UNIQUE (channel, username)
+);
+CREATE TABLE IF NOT EXISTS doubled (
+    channel TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (channel, username)
+);
+"""
+
+class SqliteStore:
+    """
+        Wheel state kept in a sqlite database, so the bots of multiple processes can share the wheels,
+        for example the twitch bot in one process and the youtube bots in another.
+        The processes have to run on the same host, with the database on a local disk: write ahead logging keeps
+        its index in shared memory, which doesn't work over a network filesystem. PostgresStore shares the wheels across hosts.
+        Every operation on a wheel runs in a transaction of its own that takes the write lock of the database right away,
+        so check-then-change operations like joining stay atomic across processes, not only within the writer of one bot manager.
+        The database is durable by itself, wheels kept in it don't need a journal.
+    """
+    #every transaction locks the whole database already, sqlite has no row locks
+    LOCK_ROW = ''
+
+    def __init__(self, path, timeout=30):
+        """fields:
+        path: path of the database file, created if missing
+        connection: connection to the database, in autocommit mode so transactions are started explicitly
+        lock: the connection is used by the writer of the bot manager, and held by it for a whole transaction
+        reader: connection for the read only queries of the bots and the metrics. with write ahead logging, reads never wait on a writer,
+                so a bot reading a flag on the event loop doesn't stall behind a transaction waiting for the write lock of the database
+        read_lock: the reader is shared by the threads of the bots and the metrics
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            #write ahead logging lets the other processes read while one of them writes
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+
+        self.reader = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.read_lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """run the with block in an immediate transaction, rolled back if the block raises"""
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def query(self, sql, args=()):
+        """run a read only query on the reader, outside of any transaction, return value is the first row"""
+        with self.read_lock:
+            return self.reader.execute(sql, args).fetchone()
+
+    def wheel(self, channel, wheel_name, wheel_sync):
+        """return the wheel of a channel kept in this database, created empty if it isn't there yet"""
+        with self.transaction() as db:
+            db.execute('INSERT INTO wheels (channel) VALUES (?) ON CONFLICT DO NOTHING', (channel,))
+        return SharedWheelState(self, channel, wheel_name, wheel_sync)
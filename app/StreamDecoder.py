@@ -0,0 +1,52 @@
+import json
+import codecs
+
+#longest unfinished object kept waiting for the rest of it, a response that goes on longer than this isn't a series of objects
+MAX_BUFFER = 16 * 2**20
+
+class StreamDecoder:
+    """
+        Incremental decoder of a streamed http response holding a series of json objects, as sent by the streaming endpoints
+        of google apis. The objects may come as the elements of one json array that is still being written,
+        or one after another, like json lines. Bytes are fed as they arrive, and every object is handed back as soon as it is complete,
+        so nothing waits for the response to end.
+    """
+    def __init__(self):
+        """fields:
+        bytes_decoder: utf-8 decoder keeping the bytes of a character split between two chunks
+        json_decoder: decodes one object at a time from the front of the buffer
+        buffer: text received and not yet decoded, starting at the next object, or the separators in front of it
+        """
+        self.bytes_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+
+    def feed(self, chunk):
+        """add a chunk of the response, return value is the list of objects completed by it.
+        raises ValueError if the response is not a series of json objects
+        """
+        self.buffer += self.bytes_decoder.decode(chunk)
+        objects = []
+        pos = 0
+        while True:
+            #skip what separates the objects: the brackets of the array, commas and white space
+            while pos < len(self.buffer) and self.buffer[pos] in '[],\r\n\t ':
+                pos += 1
+            if pos == len(self.buffer):
+                break
+
+            #every value of the series is an object, a number or a string is as wrong as text that isn't json
+            if self.buffer[pos] != '{':
+                raise ValueError(f'streamed value is not a json object: {self.buffer[pos:pos + 20]!r}')
+
+            try:
+                obj, pos = self.json_decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                #the object goes on in the next chunk
+                break
+            objects.append(obj)
+
+        self.buffer = self.buffer[pos:]
+        if len(self.buffer) > MAX_BUFFER:
+            raise ValueError('streamed object is too long')
+        return objects
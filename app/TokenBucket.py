@@ -0,0 +1,41 @@
+import time
+
+class TokenBucket:
+    """
+        Token bucket rate limiter.
+        The bucket holds up to capacity tokens and refills at rate tokens per second,
+        every allowed action takes one token out of it.
+    """
+    def __init__(self, rate, capacity):
+        """fields:
+        rate: tokens added to the bucket per second
+        capacity: maximum tokens the bucket can hold, aka the allowed burst size
+        tokens: tokens currently in the bucket, starts out full
+        last_refill: monotonic time the tokens were last topped up
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_take(self):
+        """take a token if one is available
+        return value is True if the token was taken, False if the bucket is empty
+        """
+        self.__refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """return the time in seconds until a token is available, 0 if one is available right now"""
+        self.__refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
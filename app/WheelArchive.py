@@ -0,0 +1,137 @@
+"""
+    Import and export of whole wheels, to keep a wheel, or to move it to the bots of another machine.
+    Archives are written and read as streams, one user at a time, so a big wheel is never held as one document.
+    Two formats:
+        binary: MAGIC, then per user the varint length of the name, the utf-8 name, and the varint of weight << 1 | doubled
+        json lines: one {"user": name, "weight": weight, "doubled": true or false} object per line
+    Names are interned when read, so the wheel and the rest of the bots share one copy of every name.
+"""
+import os
+import sys
+import json
+
+#first bytes of a binary archive, the last one is the version of the format
+MAGIC = b'WHEEL\x01'
+
+def _write_varint(buffer, value):
+    """append value to buffer as an unsigned LEB128 varint"""
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def _read_varint(buffer, pos):
+    """return the varint starting at pos and the position after it, raises IndexError if it runs past the buffer"""
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _check_weight(user, weight):
+    """return weight if it is a valid weight of a wheel entry, a positive int, raises ValueError otherwise"""
+    if type(weight) is not int or weight < 1:
+        raise ValueError(f'invalid weight {weight!r} of {user!r}, weights are positive integers')
+    return weight
+
+def write_binary(stream, usernames, doubled):
+    """write the weighted usernames, and who of them doubled their odds, to a binary stream"""
+    stream.write(MAGIC)
+    buffer = bytearray()
+    for user, weight in usernames.items():
+        name = user.encode()
+        _write_varint(buffer, len(name))
+        buffer += name
+        _write_varint(buffer, weight << 1 | (user in doubled))
+
+        if len(buffer) >= 1 << 16:
+            stream.write(buffer)
+            buffer.clear()
+    stream.write(buffer)
+
+def read_binary(stream, chunk_size=1 << 16):
+    """yield the (user, weight, doubled) records of a binary stream, reading it chunk_size bytes at a time.
+    raises ValueError if the stream is not a valid archive, like one with a weight of 0"""
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a binary wheel archive')
+
+    buffer = b''
+    pos = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+        while True:
+            record_start = pos
+            try:
+                length, pos = _read_varint(buffer, pos)
+                if pos + length > len(buffer):
+                    raise IndexError
+                name = buffer[pos:pos + length].decode()
+                packed, pos = _read_varint(buffer, pos + length)
+            except IndexError:
+                #the record goes on in the next chunk
+                pos = record_start
+                break
+            yield sys.intern(name), _check_weight(name, packed >> 1), bool(packed & 1)
+
+        if not chunk:
+            if pos != len(buffer):
+                raise ValueError('binary wheel archive is cut short')
+            return
+
+def write_jsonl(stream, usernames, doubled):
+    """write the weighted usernames, and who of them doubled their odds, as json lines to a text stream"""
+    for user, weight in usernames.items():
+        stream.write(json.dumps({'user': user, 'weight': weight, 'doubled': user in doubled}) + '\n')
+
+def read_jsonl(stream):
+    """yield the (user, weight, doubled) records of a json lines text stream, raises ValueError on a weight that is not a positive int"""
+    for line in stream:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        yield sys.intern(record['user']), _check_weight(record['user'], record['weight']), record.get('doubled', False)
+
+def export_wheel(path, usernames, doubled):
+    """write a wheel to an archive, json lines if path ends in .jsonl, binary otherwise.
+    the archive is written to a temporary file first and swapped in, so a failed export never leaves half an archive behind
+    """
+    temp_path = path + '.tmp'
+    if path.endswith('.jsonl'):
+        with open(temp_path, 'w', encoding='utf-8') as archive:
+            write_jsonl(archive, usernames, doubled)
+    else:
+        with open(temp_path, 'wb') as archive:
+            write_binary(archive, usernames, doubled)
+    os.replace(temp_path, path)
+
+def import_wheel(path):
+    """read a wheel from an archive of either format, told apart by the first bytes.
+    return value is the (usernames, doubled) pair, raises OSError if the archive can't be read and ValueError if it isn't valid
+    """
+    usernames = {}
+    doubled = set()
+
+    with open(path, 'rb') as archive:
+        if archive.read(len(MAGIC)) == MAGIC:
+            archive.seek(0)
+            records = read_binary(archive)
+        else:
+            archive.seek(0)
+            records = read_jsonl(line.decode('utf-8') for line in archive)
+
+        try:
+            for user, weight, was_doubled in records:
+                usernames[user] = weight
+                if was_doubled:
+                    doubled.add(user)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'invalid wheel archive: {e}')
+
+    return usernames, doubled
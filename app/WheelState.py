@@ -0,0 +1,137 @@
+class WheelState:
+    """
+        State of the wheel of one channel, kept in the memory of the process. The bot manager keeps one per channel,
+        so every channel collects names into a wheel of its own, and commands in one channel never see or change the wheel of another.
+        Only ever changed by the writer of the bot manager, which makes every operation atomic.
+        SharedWheelState has the same methods, for wheels shared by the bots of multiple processes.
+    """
+    def __init__(self, channel, wheel_name, wheel_sync, journal=None):
+        """fields:
+        channel: name of the twitch channel the wheel belongs to, the youtube bots of the same stream share it
+        wheel_name: title of the wheel on wheel of names
+        usernames: dict of usernames who are part of the wheel, mapped to their weight (number of entries on the wheel).
+                   insertion order is kept, so the wheel is built in the order people joined.
+        doubled odds usernames: a set of usernames who doubled their odds once during the execution of the bots
+        listening: if the bots are collecting usernames for this wheel
+        doubling_allowed: if !here can be used for this wheel
+        version: counter bumped by every change to the wheel, used to tell if the wheel changed since it was last synced
+        wheel_sync: keeps the wheel on wheel of names in sync, and skips uploads when nothing changed
+        journal: optional journal every change to the wheel is written to. If given, the wheel it holds is restored here
+        sync_requested: set when listening stops, so the background sync, if running, pushes the wheel right away
+        """
+        self.channel = channel
+        self.wheel_name = wheel_name
+        self.usernames = {}
+        self.doubled_odds_usernames = set()
+        self.listening = False
+        self.doubling_allowed = False
+        self.version = 0
+        self.wheel_sync = wheel_sync
+        self.journal = journal
+        self.sync_requested = False
+
+        if self.journal is not None:
+            self.usernames, self.doubled_odds_usernames = self.journal.replay()
+
+    def __changed(self, op, arg):
+        """bump the version of the wheel and write the change to the journal, if there is one
+        op is the name of the journal method recording the change, arg its argument
+        """
+        self.version += 1
+
+        if self.journal is not None:
+            getattr(self.journal, op)(arg)
+            if self.journal.should_compact():
+                self.journal.compact(self.usernames, self.doubled_odds_usernames)
+
+    def is_listening(self):
+        return self.listening
+
+    def set_listening(self, toggle):
+        self.listening = toggle
+
+    def toggle_doubling(self):
+        """flip doubling_allowed, return value is the new value"""
+        self.doubling_allowed = not self.doubling_allowed
+        return self.doubling_allowed
+
+    def size(self):
+        """return the amount of usernames on the wheel"""
+        return len(self.usernames)
+
+    def join(self, username, max_users) -> int:
+        """add a username to the wheel, exit codes are the ones of BotManager.add_username_to_wheel"""
+        if not self.listening:
+            return -3
+
+        if len(self.usernames) >= max_users:
+            return -2
+
+        if username in self.usernames:
+            return -1
+
+        self.usernames[username] = 1
+        self.__changed('join', username)
+        return 0
+
+    def double(self, username) -> int:
+        """double the weight of a username, exit codes are the ones of BotManager.double_odds"""
+        if self.listening:
+            return -4
+
+        if not self.doubling_allowed:
+            return -3
+
+        if username in self.doubled_odds_usernames:
+            return -2
+
+        if username not in self.usernames:
+            return -1
+
+        self.usernames[username] *= 2
+        self.doubled_odds_usernames.add(username)
+        self.__changed('double', username)
+
+        return 0
+
+    def snapshot(self, synced_version, while_listening=False):
+        """copy the wheel to upload, along with its version. None if the bots are listening, unless while_listening is set.
+        the usernames are None, instead of a copy, if synced_version, the version the remote wheel holds, is already the current one
+        """
+        if self.listening and not while_listening:
+            return None
+
+        if self.version == synced_version:
+            return None, self.version
+        return dict(self.usernames), self.version
+
+    def replace(self, usernames):
+        """replace the wheel with the given weighted usernames of a loaded wheel.
+        return value is the new version, None if the bots started listening in the meantime and nothing was replaced
+        """
+        if self.listening:
+            return None
+
+        self.usernames = dict(usernames)
+        self.__changed('load', self.usernames)
+        return self.version
+
+    def entries(self):
+        """copy the whole wheel for an export, return value is the (usernames, doubled_odds_usernames) pair"""
+        return dict(self.usernames), set(self.doubled_odds_usernames)
+
+    def restore(self, usernames, doubled):
+        """replace the wheel, and who doubled their odds on it, with an imported wheel. the given dict and set are taken over, not copied.
+        return value is the new version, None if the bots are listening and nothing was replaced
+        """
+        if self.listening:
+            return None
+
+        self.usernames = usernames
+        self.doubled_odds_usernames = doubled
+        self.version += 1
+
+        #the journal can't record who doubled with a load, write the whole imported wheel to the snapshot instead
+        if self.journal is not None:
+            self.journal.compact(self.usernames, self.doubled_odds_usernames)
+        return self.version
@@ -0,0 +1,106 @@
+import json
+import threading
+import requests
+from Metrics import metrics
+
+WON_API_URL = 'https://wheelofnames.com/api/v1'
+
+class WheelSync:
+    """
+        Keeps one private wheel on wheel of names in sync with the wheel of the bot manager.
+        The path of the remote wheel and the version of the entries it was last synced with are remembered,
+        so a sync without any change in between is skipped, and loading goes straight to the known wheel.
+        All requests share one pooled requests session.
+    """
+    def __init__(self, won_key, wheel_name, api_url=WON_API_URL):
+        """fields:
+        wheel_name: title of the wheel on wheel of names
+        api_url: base url of the wheel of names api
+        session: pooled http session, carrying the api key
+        path: path of the remote wheel, known after the first successful upload or load
+        synced_version: version of the entries the remote wheel holds, None if unknown. it only ever goes up,
+                        so a sync that took its snapshot before a newer one was uploaded can't put the older entries back
+        lock: lets only one request run at a time, so concurrent syncs can't overtake each other. guards synced_version too
+        """
+        self.wheel_name = wheel_name
+        self.api_url = api_url
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'x-api-key': won_key
+        })
+        self.path = None
+        self.synced_version = None
+        self.lock = threading.Lock()
+
+    def push(self, usernames, version):
+        """upload the weighted usernames as the wheel, unless the remote wheel already holds this version of them, or a newer one.
+        usernames is None if the snapshot found the wheel unchanged since the last sync.
+        return value is True if an upload was made, False if it was skipped. Raises on api errors.
+        """
+        if usernames is None:
+            return False
+
+        wheel = {
+            'config': {
+                'title': self.wheel_name,
+                'description': 'A wheel of elite Ghostdivers.',
+                #every entry of a user is the same dict, a weighted user costs one list slot per entry instead of a dict each
+                'entries': [entry for user, weight in usernames.items() for entry in [{'text': user}] * weight]
+            }
+        }
+
+        with self.lock, metrics.timer('wheelofnames_api_seconds', call='push'):
+            if self.__holds(version):
+                return False
+
+            response = self.session.put(f'{self.api_url}/wheels/private', data=json.dumps(wheel),
+                                        headers={'Content-Type': 'application/json'})
+            response.raise_for_status()
+            self.path = response.json()['data']['path']
+            self.synced_version = version
+        return True
+
+    def __holds(self, version):
+        """return True if the remote wheel holds the given version of the entries or a newer one, only called under the lock"""
+        return self.synced_version is not None and version <= self.synced_version
+
+    def __fetch_known_wheel(self):
+        """get the config of the wheel at the remembered path, None if that fails"""
+        try:
+            response = self.session.get(f'{self.api_url}/wheels/{self.path}')
+            response.raise_for_status()
+            config = response.json()['data']['wheel']['config']
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            return None
+
+        return config if config.get('title') == self.wheel_name else None
+
+    def pull(self):
+        """download the entries of the wheel. The remembered path is tried first, the private wheels of the account
+        are only searched for the title when it is unknown or stale.
+        return value is the list of entries, None if no wheel with the title exists. Raises on api errors.
+        """
+        with self.lock, metrics.timer('wheelofnames_api_seconds', call='pull'):
+            config = self.__fetch_known_wheel() if self.path else None
+
+            if config is None:
+                response = self.session.get(f'{self.api_url}/wheels/private')
+                response.raise_for_status()
+
+                #loop over the titles from the json response and grab the wheel that matches the name.
+                for wheel in response.json()['data']['wheels']:
+                    if wheel['config']['title'] == self.wheel_name:
+                        config = wheel['config']
+                        self.path = wheel.get('path', self.path)
+                        break
+                else:
+                    return None
+
+        return config['entries']
+
+    def loaded(self, version):
+        """mark the remote wheel as holding the given version of the entries, after they were replaced with a pulled wheel"""
+        with self.lock:
+            if not self.__holds(version):
+                self.synced_version = version
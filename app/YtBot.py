@@ -1,140 +1,457 @@
+import sys
 import time
+import asyncio
+import threading
 from collections import deque
-from datetime import datetime, timedelta, timezone
+import aiohttp
+from google.auth.exceptions import GoogleAuthError
+from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from NameCache import NameCache
+from ChatCommand import ChatCommand
+from DedupWindow import DedupWindow
+from StreamDecoder import StreamDecoder
+from ReplyQueue import ReplyQueue
+from CommandRegistry import default_registry
+from PollScheduler import PollScheduler
+from QuotaLedger import QuotaLedger
+from Metrics import metrics
+
+YT_API_URL = 'https://www.googleapis.com/youtube/v3'
+
+#identity of the owner of a chat, see identity()
+OWNER_IDENTITY = 'youtube:owner'
+
+class ApiError(Exception):
+    """a request the youtube data api turned down, raised the same way in both modes, from the HttpError of the api client
+    in a thread and from the response of the aiohttp session in async mode
+    """
+    def __init__(self, status, details):
+        super().__init__(f'{status} {details}')
+        self.status = status
+        self.details = details
+
+#what a failed request to the youtube data api raises in either mode: turned down, youtube can't be reached,
+#or the access token can't be refreshed
+REQUEST_ERRORS = (ApiError, OSError, aiohttp.ClientError, asyncio.TimeoutError, GoogleAuthError)
+
+#the http method and path of every call of the youtube data api the bots make, for async mode, by the name its quota is recorded under.
+#in a thread the same names pick the method of the api client, like liveChatMessages().list()
+API_CALLS = {
+    'liveBroadcasts.list': ('GET', 'liveBroadcasts'),
+    'channels.list': ('GET', 'channels'),
+    'liveChatMessages.list': ('GET', 'liveChat/messages'),
+    'liveChatMessages.insert': ('POST', 'liveChat/messages'),
+}
+
+def identity(channel_id):
+    """return who the author of a youtube message is to the allowed users of the bot manager.
+    youtube users are authorized by the id of their channel, display names are neither unique nor fixed.
+    the prefix keeps them apart from twitch logins, which can't hold a colon
+    """
+    return f'youtube:{channel_id}'
 
 class YtBot:
-    def __init__(self, bot_manager, verbosity,  flow, livestream_id):
+    def __init__(self, bot_manager, verbosity,  credentials, livestream_id, channel, max_messages=300, min_interval=1, quota=None, registry=None,
+                 checkpoint=None, streaming=False):
         """fields:
-        start_time: record the starting time of the bot to prevent is from reading messages before it starts
-        credentials: the credentials received from the oauth flow passed to the constructor
+        start_time: record the starting time of the bot to prevent is from reading messages before it starts, in epoch milliseconds.
+                    when resuming from a checkpoint, the time of the last command processed instead, or the time the first bot
+                    started if it processed none, so the commands sent while the bot was down are not lost
+        credentials: the credentials returned by yt_auth.Authorize, shared by the bots of all livestreams. The access token is refreshed
+                     when it expires, by the api client when running in a thread, and by __request_async in async mode
         bot_manager: the bot manager singleton that has the command executions and shared data
         livestream_id: the Id of the livestream the bot will conecct to
-        livestream_chat_id: the id of the livestream's chat. Will be set at the end of the constructor
+        livestream_chat_id: the id of the livestream's chat. Looked up once the bot runs, until the stream is found
+        channel: the twitch channel whose wheel the commands of this livestream act on
         verbose: verbosity of the commands executed as defined in the config.json
-        paging_token: paging token received from the polling API request to the chat.
-        MAX_MESSAGES: maximum number of messages that will be stored before deleting the oldest messages
-        MIN_INTERVAL: the minimum interval required between two of the same command from a person to be processed.
-        all_messages: a set of all messages sent to the chat
-        unread_messages: a double-ended queue for messages that were unprocessed for commands
+        paging_token: paging token received from the polling API request to the chat. Restored from the checkpoint, if any
+        streaming: read the chat over the liveChatMessages.streamList streaming endpoint in async mode, instead of polling it.
+                   every response is processed as soon as it arrives, so commands don't wait for the polling interval.
+                   turned off, and polling takes over, if youtube doesn't offer streaming for the chat. threads always poll
+        STREAM_IDLE_TIMEOUT: seconds without any data after which the stream is considered dead and opened again
+        stream_auth_retried: set once the stream was opened again right away after its token was turned down,
+                             until a stream opens. a token turned down again backs off like any failed stream
+        checkpoint: optional ChatCheckpoint the page token and the processed commands are saved to after every poll,
+                    so a restarted bot resumes where it stopped, and never runs the command of a message twice
+        quota: ledger of the api quota used, shared by the bots of all livestreams. A ledger of its own is made if none is given
+        scheduler: decides the wait between two polls, from the interval youtube asks for, the time the cycle took,
+                   whether names are being collected, and the failures in a row
+        MAX_MESSAGES: maximum number of messages remembered to drop repeats, before forgetting the oldest ones, defaults to 300
+        MIN_INTERVAL: the minimum interval required between two of the same command from a person to be processed, in milliseconds,
+                      defaults to 1 second.
+        registry: the commands the bot understands, shared with the twitch bot. The default commands if none is given.
+                  every chat message that isn't one of them is dropped on arrival
+        recent_messages: sliding window of the (userId, message text) pairs accepted within the last MIN_INTERVAL, used to drop repeats
+        unread_messages: a double-ended queue of the ChatCommands that were not run yet
+        name_cache: LRU cache of channel id -> username, filled from the authorDetails of the chat messages,
+                    so channels().list is only called for authors missing from it
+        loop: the asyncio event loop the bot runs on when started with run_async, None when running in its own thread
+        session: the aiohttp session used for the youtube api calls in async mode, can be shared between multiple bots
+        replies: rate limited queue the replies to the chat are sent through, created once the bot starts running
+        REPLY_RATE and REPLY_BURST: sustained replies per second and the amount of replies that can be sent at once
+        MAX_REPLY_LENGTH: most characters of a youtube chat message, liveChatMessages.insert turns down longer ones
         """
 
-        self.start_time = datetime.now(timezone.utc)
-        self.credentials = flow.credentials
+        self.start_time = time.time_ns() // 1_000_000
+        self.credentials = credentials
         self.bot_manager = bot_manager
         self.livestream_id = livestream_id
         self.livestream_chat_id = None
+        self.channel = channel
         self.verbose = verbosity
         self.paging_token = None
-        self.pollingIntervalMillis = 0
-        self.MAX_MESSAGES = 300
-        self.MIN_INTERVAL = timedelta(seconds=1)
+        self.checkpoint = checkpoint
+        self.streaming = streaming
+        self.STREAM_IDLE_TIMEOUT = 300
+        self.stream_auth_retried = False
+        self.quota = quota or QuotaLedger()
+        self.scheduler = PollScheduler()
+        self.MAX_MESSAGES = max_messages
+        self.MIN_INTERVAL = int(min_interval * 1000)
+        self.registry = registry or default_registry()
+        self.loop = None
+        self.session = None
+        self.replies = None
+        self.REPLY_RATE = 1
+        self.REPLY_BURST = 3
+        self.MAX_REPLY_LENGTH = 200
+
+        if self.checkpoint is not None:
+            self.paging_token = self.checkpoint.page_token
+            if self.checkpoint.last_sent_ms is not None:
+                self.start_time = self.checkpoint.last_sent_ms
+            elif self.checkpoint.started_ms is not None:
+                self.start_time = self.checkpoint.started_ms
+            else:
+                self.checkpoint.started(self.start_time)
 
-        #building of the youtube service object
-        self.youtube = build('youtube', 'v3', credentials=self.credentials)
+        #the youtube service objects are built on first use, one per thread, async mode doesn't need them at all.
+        #the http connection of the api client isn't thread safe, and the replies are sent from the thread of the reply queue
+        self.youtube = threading.local()
 
-        #collection of tuples of userId who sent the message, the message sent, and the timestamp
-        self.all_messages = set()
-        self.unread_messages = deque(maxlen=self.MAX_MESSAGES)
+        self.recent_messages = DedupWindow(self.MAX_MESSAGES, self.MIN_INTERVAL)
+        #not capped, it is drained every poll so it never holds more than a page, and a cap would drop the commands of a busy page
+        self.unread_messages = deque()
 
-        #get the chat identification from the stream id
-        self.__get_streamchat_Id()
+        self.name_cache = NameCache(max_size=5000, ttl=3600)
+
+        metrics.set_gauge('name_cache_hit_ratio', self.name_cache.hit_rate, livestream=livestream_id)
+        metrics.set_gauge('youtube_quota_remaining', self.quota.remaining)
+
+    def __service(self):
+        """return the youtube service object of the calling thread, built on its first use.
+        the discovery document is the one shipped with the api client, so building it needs no request
+        """
+        service = getattr(self.youtube, 'service', None)
+        if service is None:
+            service = self.youtube.service = build('youtube', 'v3', credentials=self.credentials, static_discovery=True, cache_discovery=False)
+        return service
+
+    def __set_streamchat_Id(self, response):
+        """set the id of the livechat from a liveBroadcasts().list response.
+        a stream that isn't live yet has no chat, it is looked up again later
+        """
+        try:
+            self.livestream_chat_id = response['items'][0]['snippet']['liveChatId']
+        except (IndexError, KeyError):
+            print(f"Error: Stream with ID {self.livestream_id} not found, or it has no live chat yet.")
 
     def __get_streamchat_Id(self):
         """get, and set the id of the livechat, from the id of a stream
         return value is the id of the livechat
         """
         try:
-            stream = self.youtube.liveBroadcasts().list(
-                part="snippet",
-                id=self.livestream_id
-            )
-            response = stream.execute()
-            self.livestream_chat_id = response['items'][0]['snippet']['liveChatId']
+            self.__set_streamchat_Id(self.__request('liveBroadcasts.list', {'part': 'snippet', 'id': self.livestream_id}))
+        except REQUEST_ERRORS as e:
+            self.__report_error(e, f"Error: Stream with ID {self.livestream_id} not found.")
+
+        return self.livestream_chat_id
+
+    def __wait_for_chat(self):
+        """look up the id of the livechat until it is found, backing off between the attempts like failed polls do"""
+        while self.__get_streamchat_Id() is None:
+            self.scheduler.failure()
+            time.sleep(self.scheduler.next_delay(0, False))
+        self.scheduler.success(None)
+
+
+    def __request(self, call, params, body=None):
+        """make a request to the youtube data api with the api client, recording its quota cost and duration under the name call,
+        one of API_CALLS. params are the query parameters, and body the json body, of the request.
+        return value is the decoded json response, ApiError is raised if youtube turns the request down
+        """
+        resource, method = call.split('.')
+        if body is not None:
+            params = {**params, 'body': body}
+        request = getattr(getattr(self.__service(), resource)(), method)(**params)
+
+        self.quota.record(call)
+        try:
+            with metrics.timer('youtube_api_seconds', call=call):
+                return request.execute()
         except HttpError as e:
-            status = e.resp.status
-            if status == 403:
-                print("Error: Insufficient permissions to access the live stream. Check API scope and user permissions.")
-            if status == 404:
-                print(f"Error: Stream with ID {self.livestream_id} not found.")
-            else:
-                print(f"An unexpected error occurred: {e}")
+            raise ApiError(e.resp.status, e.content.decode(errors='replace')) from e
+
+    async def __request_async(self, call, params, body=None):
+        """async version of __request, made with the shared aiohttp session.
+        the access token is refreshed once it expires, or if youtube turns it down anyway, and the request is retried
+        once with the new token, so no poll or reply is lost to an expired token
+        """
+        if not self.credentials.valid:
+            await self.__refresh_credentials()
+
+        try:
+            return await self.__send_request(call, params, body)
+        except ApiError as e:
+            if e.status != 401:
+                raise
+
+        await self.__refresh_credentials()
+        return await self.__send_request(call, params, body)
+
+    async def __refresh_credentials(self):
+        """refresh the access token, the blocking refresh is pushed to the default executor so the loop keeps running"""
+        with metrics.timer('youtube_token_refresh_seconds'):
+            await self.loop.run_in_executor(None, self.credentials.refresh, Request())
+
+    async def __send_request(self, call, params, body):
+        """make a single request for __request_async"""
+        method, resource = API_CALLS[call]
+        self.quota.record(call)
+        headers = {'Authorization': f'Bearer {self.credentials.token}'}
+        with metrics.timer('youtube_api_seconds', call=call):
+            async with self.session.request(method, f'{YT_API_URL}/{resource}', params=params, json=body, headers=headers) as response:
+                #keep the error body in the message, it holds the reason of the failure, like an exceeded quota
+                if response.status >= 400:
+                    raise ApiError(response.status, await response.text())
+                return await response.json()
+
+    @staticmethod
+    def __report_error(e, not_found):
+        """print why a request of either mode failed, one of REQUEST_ERRORS. not_found is printed if youtube doesn't know what was asked for"""
+        if isinstance(e, GoogleAuthError):
+            print(f"Failed to refresh the youtube token: {e}")
+        elif not isinstance(e, ApiError):
+            print(f"Failed to reach youtube: {e}")
+        elif e.status == 403:
+            print("Error: Insufficient permissions to access the live stream. Check API scope and user permissions.")
+        elif e.status == 404:
+            print(not_found)
+        else:
+            print(f"An unexpected error occurred: {e}")
+
+    async def __get_streamchat_Id_async(self):
+        """async version of __get_streamchat_Id"""
+        try:
+            self.__set_streamchat_Id(await self.__request_async('liveBroadcasts.list', {'part': 'snippet', 'id': self.livestream_id}))
+        except REQUEST_ERRORS as e:
+            self.__report_error(e, f"Error: Stream with ID {self.livestream_id} not found.")
+
+        return self.livestream_chat_id
 
+    async def __wait_for_chat_async(self):
+        """async version of __wait_for_chat"""
+        while await self.__get_streamchat_Id_async() is None:
+            self.scheduler.failure()
+            await asyncio.sleep(self.scheduler.next_delay(0, False))
+        self.scheduler.success(None)
+
+    @staticmethod
+    def __is_quota_error(status, details):
+        """tell if a failed request was refused because the quota or rate limit of the api ran out"""
+        details = details.lower()
+        return status == 429 or (status == 403 and ('quota' in details or 'ratelimitexceeded' in details))
 
     def __get_user_name(self, userId):
-        """given a userid, return the channel name, aka the username"""
-        channelDetails = self.youtube.channels().list(
-            part="snippet",
-            id=userId,
-        )
-    
-        response = channelDetails.execute()
-        return response['items'][0]['snippet']['title']
-    
+        """given a userid, return the channel name, aka the username
+        the name is taken from the cache if possible, only uncached users cost a channels().list call
+        """
+        username = self.name_cache.get(userId)
+        if username is None:
+            username = self.__cache_user_name(userId, self.__request('channels.list', {'part': 'snippet', 'id': userId}))
+        return username
+
+    async def __get_user_name_async(self, userId):
+        """async version of __get_user_name"""
+        username = self.name_cache.get(userId)
+        if username is None:
+            username = self.__cache_user_name(userId, await self.__request_async('channels.list', {'part': 'snippet', 'id': userId}))
+        return username
+
+    def __cache_user_name(self, userId, response):
+        """cache the name of a channel from its channels().list response, return value is the name.
+        raises IndexError or KeyError if youtube has no channel with that id
+        """
+        username = response['items'][0]['snippet']['title']
+        self.name_cache.put(userId, username)
+        return username
+
+    def __verbose(self):
+        """verbose replies are only sent while enough quota is left, they are the first thing to go when it runs low"""
+        return self.verbose and self.quota.verbose_allowed()
+
+    def __poll_delay(self, elapsed):
+        """time in seconds to wait before the next poll, stretched when the quota runs low, but never past its reset"""
+        delay = self.scheduler.next_delay(elapsed, self.bot_manager.is_listening(self.channel)) * self.quota.poll_slowdown()
+        return min(delay, self.quota.seconds_until_reset())
+
+    def __reply(self, message, sent_at):
+        """queue a reply to the chat, so the command processing never waits for it to be sent
+        sent_at is the epoch time of the command replied to
+        """
+        self.replies.put(message, sent_at)
+
+    def __reply_body(self, message):
+        """the body of the liveChatMessages().insert request sending a message to the chat"""
+        return {
+            "snippet": {
+                "liveChatId": self.livestream_chat_id,
+                "type": "textMessageEvent",
+                "textMessageDetails": {
+                    "messageText": message,
+                }
+            }
+        }
+
     def __send_reply_to_livechat(self, message):
         """
         given a message, send the message to the chat
         """
         try:
-            reply = self.youtube.liveChatMessages().insert(
-                part="snippet",
-                body={
-                    "snippet": {
-                        "liveChatId": self.livestream_chat_id,
-                        "type": "textMessageEvent",
-                        "textMessageDetails": {
-                            "messageText": message,
-                        }
-                    }
-                }
-            )
-            response = reply.execute()
-        except HttpError as e:
-            status = e.resp.status
-            if status == 403:
-                print("Error: Insufficient permissions to access the live stream. Check API scope and user permissions.")
-            if status == 404:
-                print(f"Error: Stream with ID {self.livestream_id} not found.")
-            else:
-                print(f"An unexpected error occurred: {e}")
-    
+            self.__request('liveChatMessages.insert', {'part': 'snippet'}, self.__reply_body(message))
+        except ApiError as e:
+            self.__report_error(e, f"Error: Stream with ID {self.livestream_id} not found.")
+
+    async def __send_reply_to_livechat_async(self, message):
+        """async version of __send_reply_to_livechat"""
+        try:
+            await self.__request_async('liveChatMessages.insert', {'part': 'snippet'}, self.__reply_body(message))
+        except ApiError as e:
+            self.__report_error(e, f"Error: Stream with ID {self.livestream_id} not found.")
+
     def __grab_messages(self):
-        """"Grabs chat messages according to paging token, and sets pollingIntervalMillis
+        """"Grabs chat messages according to paging token, and reports the result to the poll scheduler
 
-        return value is an array of livechat message objects, ready for further processing.
+        return value is the array of livechat message objects, ready for further processing, and the paging token of the next page.
+        None if the request failed. paging_token is left as it is, it only moves on once the page was processed
         """
-        latest_chat = None
         try:
-            #if paging token is unset, this is the first request, try to grab everything
-            if self.paging_token is None:
-                latest_chat = self.youtube.liveChatMessages().list(
-                    liveChatId=self.livestream_chat_id,
-                    part="snippet"
-                )
-            else:
-                latest_chat = self.youtube.liveChatMessages().list(
-                    liveChatId=self.livestream_chat_id,
-                    part="snippet",
-                    pageToken=self.paging_token
-                )
-            response = latest_chat.execute()
-            self.paging_token = response['nextPageToken']
-            self.pollingIntervalMillis = response['pollingIntervalMillis']
+            return self.__polled(self.__request('liveChatMessages.list', self.__chat_params()))
+        except REQUEST_ERRORS as e:
+            self.__poll_failed(e)
 
-            return response['items']
+    async def __grab_messages_async(self):
+        """async version of __grab_messages"""
+        try:
+            return self.__polled(await self.__request_async('liveChatMessages.list', self.__chat_params()))
+        except REQUEST_ERRORS as e:
+            self.__poll_failed(e)
+
+    def __chat_params(self):
+        """the query parameters reading the chat from paging_token, by a poll or the stream"""
+        params = {'liveChatId': self.livestream_chat_id, 'part': 'snippet,authorDetails'}
+        #if paging token is unset, this is the first request, try to grab everything
+        if self.paging_token is not None:
+            params['pageToken'] = self.paging_token
+        return params
+
+    def __polled(self, response):
+        """report a poll that went through to the poll scheduler, return value is the (messages, next paging token) of its response"""
+        self.scheduler.success(response.get('pollingIntervalMillis'))
+        return response['items'], response['nextPageToken']
+
+    def __poll_failed(self, e):
+        """report a failed poll to the poll scheduler. a token that couldn't be refreshed is tried again on the next poll"""
+        self.__report_error(e, "Error: Chat not found not found.")
+        if isinstance(e, ApiError):
+            self.scheduler.failure(self.__is_quota_error(e.status, e.details))
+            self.__drop_stale_page_token(e.status)
+        else:
+            self.scheduler.failure()
+
+    async def __stream_messages_async(self):
+        """read the chat over the streaming endpoint, and process the messages of every response as soon as it arrives.
+        returns once the stream ends or breaks, it is opened again from the last page token then.
+        return value is False if youtube doesn't offer streaming for the chat, True otherwise
+        """
+        params = self.__chat_params()
+        pages = 0
+        try:
+            if not self.credentials.valid:
+                await self.__refresh_credentials()
+
+            self.quota.record('liveChatMessages.streamList')
+            headers = {'Authorization': f'Bearer {self.credentials.token}'}
+            timeout = aiohttp.ClientTimeout(total=None, sock_read=self.STREAM_IDLE_TIMEOUT)
+            async with self.session.get(f'{YT_API_URL}/liveChat/messages/stream', params=params, headers=headers, timeout=timeout) as response:
+                if response.status == 401:
+                    #the token was turned down before it expired, refresh it and open the stream again,
+                    #right away the first time only, so a token youtube keeps turning down can't make it spin
+                    if self.stream_auth_retried:
+                        self.scheduler.failure()
+                        await asyncio.sleep(self.__poll_delay(0))
+                    self.stream_auth_retried = True
+                    await self.__refresh_credentials()
+                    return True
+
+                if response.status >= 400:
+                    details = await response.text()
+                    if self.__is_quota_error(response.status, details):
+                        self.scheduler.failure(True)
+                        await asyncio.sleep(self.__poll_delay(0))
+                        return True
+
+                    if response.status == 400 and self.paging_token is not None:
+                        self.__drop_stale_page_token(response.status)
+                        return True
+
+                    print(f"Streaming the youtube chat is not available, polling it instead: {response.status} {details}")
+                    return False
+
+                self.stream_auth_retried = False
+                metrics.inc('youtube_streams_opened_total')
+                self.scheduler.success(None)
+                decoder = StreamDecoder()
+                async for chunk in response.content.iter_any():
+                    #only a response that isn't a series of json objects means the stream can't be read,
+                    #an error processing the messages is not a reason to stop streaming
+                    try:
+                        received = decoder.feed(chunk)
+                    except ValueError as e:
+                        print(f"The youtube chat stream can't be read, polling it instead: {e}")
+                        return False
+
+                    for page in received:
+                        pages += 1
+                        self.__setup_unread_messages(page.get('items', []))
+                        await self.__process_for_commands_async()
+                        #the token only moves past the page once its commands ran, a stream opened again never skips it
+                        self.paging_token = page.get('nextPageToken', self.paging_token)
+                        await self.loop.run_in_executor(None, self.__save_checkpoint)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, GoogleAuthError) as e:
+            print(f"The youtube chat stream broke, opening it again: {e}")
+            self.scheduler.failure()
+            await asyncio.sleep(self.__poll_delay(0))
+            return True
+
+        #a stream that ends without a single response is not opened again right away, so a closing server can't make it spin
+        if pages == 0:
+            await asyncio.sleep(self.__poll_delay(0))
+        return True
+
+    def __drop_stale_page_token(self, status):
+        """a page token restored from a checkpoint can expire while the bot is down, and youtube turns it down as a bad request.
+        the chat is read from the newest messages then, the checkpoint keeps the commands already processed from running again
+        """
+        if status == 400 and self.paging_token is not None:
+            print("The saved youtube page token was turned down, reading the chat from the newest messages")
+            self.paging_token = None
 
-        except HttpError as e:
-            status = e.resp.status
-            if status == 403:
-                print("Error: Insufficient permissions to access the live stream. Check API scope and user permissions.")
-            if status == 404:
-                print(f"Error: Chat not found not found.")
-            else:
-                print(f"An unexpected error occurred: {e}")
-    
     def __setup_unread_messages(self, livechat_message_objects):
-        """function to setup the arrays all_messages and unread_messages 
+        """function to setup recent_messages and unread_messages 
         for actual command processing.
 
         parameter is livechat_message object retreived from the API call made
@@ -142,121 +459,243 @@ class YtBot:
 
         at the end, unread_messages field is setup with messages yet unprocessed 
         for commands. 
+
+        messages that are not a command are dropped before anything else is done with them,
+        so plain chat costs a dict lookup and a command registry lookup per message.
+        commands are kept as ChatCommand records, with the channel id and name of the author interned
+        and the time they were sent in epoch milliseconds, so no datetime is made per message.
         """
 
         for message_obj in livechat_message_objects:
-            userId = message_obj['snippet']['authorChannelId']
-            message = message_obj['snippet']['textMessageDetails']['messageText']
-            timestamp = message_obj['snippet'] ['publishedAt']
-
-            message_time = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f%z")
-            
-            #ignore messages if they were before start time of the bot
-            message_tuple = (userId, message, message_time)
-
-
-            # Check for recent duplicate messages by the same user
-            if not any(
-                userId == msg[0] and message == msg[1] and message_time - msg[2] < self.MIN_INTERVAL
-                for msg in self.all_messages
-            ):
-                self.unread_messages.append((userId, message, message_time))
-                self.all_messages.add(message_tuple)
-
-                # Ensure `all_messages` only holds the last 300 unique messages
-                if len(self.all_messages) > self.MAX_MESSAGES:
-                    # Remove the oldest message to maintain the limit
-                    oldest_message = next(iter(self.all_messages))
-                    self.all_messages.remove(oldest_message)
+            #non-text events such as super chats have no textMessageDetails
+            text_details = message_obj['snippet'].get('textMessageDetails')
+            if text_details is None:
+                continue
+
+            message = text_details['messageText']
+            parsed = self.registry.parse(message)
+            if parsed is None:
+                continue
+
+            userId = sys.intern(message_obj['snippet']['authorChannelId'])
+            sent_ms = ChatCommand.epoch_millis(message_obj['snippet']['publishedAt'])
+
+            #the display name comes with the message, so keep the cache fresh without an extra api call
+            author = message_obj.get('authorDetails', {})
+            if 'displayName' in author:
+                self.name_cache.put(userId, sys.intern(author['displayName']))
+
+            # Check for recent duplicate messages by the same user, then for users flooding the chat. the owner of the chat is never limited
+            owner = author.get('isChatOwner', False)
+            if self.recent_messages.accept((userId, message), sent_ms) and (owner or self.registry.admit(self.channel, userId)):
+                self.unread_messages.append(ChatCommand(message_obj['id'], userId, parsed[0], parsed[1], sent_ms, owner))
 
     def __process_for_commands(self):
         """function to process the messages in unread_messages for commands.
-        currently, only !wheel and !here are allowed in the youtube bot.
-        the syntax for the commands is precise.
-        
+        the commands are the ones of the command registry, the same as the twitch bot's.
         """
-        to_remove = []  # Collect messages to remove after processing
-
-        for message in self.unread_messages:
-            userId = message[0]
-            message_text = message[1]
-            time = message[2]
-
-            #if the message was sent before the bot started, ignore
-            if time < self.start_time:
+        pending = []
+        for message in self.__commands_to_run():
+            try:
+                username = self.__get_user_name(message.user_id)
+            except (IndexError, KeyError, *REQUEST_ERRORS) as e:
+                if self.__lookup_failed(message, e):
+                    break
+                continue
+            pending.append(self.__submit_command(message, username))
+
+        self.__finish_commands(pending)
+
+    async def __process_for_commands_async(self):
+        """async version of __process_for_commands"""
+        pending = []
+        for message in self.__commands_to_run():
+            try:
+                username = await self.__get_user_name_async(message.user_id)
+            except (IndexError, KeyError, *REQUEST_ERRORS) as e:
+                if self.__lookup_failed(message, e):
+                    break
                 continue
+            pending.append(self.__submit_command(message, username))
 
-            username = self.__get_user_name(userId)
+        #wait for the batch without blocking the loop, the results are all in once __finish_commands gets them
+        futures = [asyncio.wrap_future(future) for _, _, future in pending if future is not None]
+        if futures:
+            await asyncio.wait(futures)
+        self.__finish_commands(pending)
 
-            if message_text == "!wheel":
-                self.__wheel_command(username)
-            elif message_text == "!here":
-                self.__here_command(username)
+    def __commands_to_run(self):
+        """take the ChatCommands out of unread_messages one by one, the ones that must not run are skipped.
+        a command handed out and not submitted, because the name of its author couldn't be looked up, is put back by __lookup_failed
+        """
+        while self.unread_messages:
+            message = self.unread_messages.popleft()
 
-            to_remove.append(message)  # Mark message for removal
+            #if the message was sent before the bot started, or its command was already run before a restart, ignore
+            if message.sent_ms < self.start_time or self.__already_processed(message):
+                continue
+            yield message
 
-        #remove all processed messages
-        for message in to_remove:
-            self.unread_messages.remove(message)
+    def __lookup_failed(self, message, e):
+        """handle a ChatCommand whose author's name couldn't be looked up.
+        return value is True if youtube couldn't be asked, the batch stops then, False if the author has no channel and the command is dropped
+        """
+        if isinstance(e, (IndexError, KeyError)):
+            print(f"Ignoring a command of {message.user_id}, youtube has no channel with that id")
+            return False
+
+        #the command and the ones after it wait in unread_messages for the next poll
+        print(f"Failed to look up the name of {message.user_id}, retrying after the next poll: {e}")
+        self.unread_messages.appendleft(message)
+        return True
+
+    def __finish_commands(self, pending):
+        """report the exit codes of a batch of submitted commands, as returned by __submit_command, and mark them as processed.
+        the whole batch is submitted before waiting on any result, so the bot manager works through it in one go
+        """
+        for message, username, future in pending:
+            if future is not None:
+                try:
+                    ret = future.result()
+                except Exception as e:
+                    self.__command_failed(message, e)
+                    continue
+                self.__respond(message.command, ret, username, message.sent_ms)
+            self.__mark_processed(message)
+
+    def __already_processed(self, message):
+        """return True if the command of a ChatCommand was run before, according to the checkpoint"""
+        if self.checkpoint is None or not self.checkpoint.seen(message.message_id):
+            return False
+
+        metrics.inc('youtube_commands_replayed_total')
+        return True
+
+    def __command_failed(self, message, e):
+        """report a command that raised instead of returning an exit code, like one whose database was locked.
+        the bot carries on with the next command, the failed one isn't marked as processed
+        """
+        print(f"The youtube command {message.command.name} of {message.user_id} failed: {e!r}")
+        metrics.inc('commands_failed_total', platform='youtube', command=message.command.name)
 
+    def __mark_processed(self, message):
+        """record the command of a ChatCommand as run, once its exit code is in. it is saved with the page token
+        after the page it came with is processed, so a command that never finished is run again by a restarted bot
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.processed(message.message_id, message.sent_ms)
 
-    def __wheel_command(self, username):
-        """function to try to add a given username to the list of wheel candidates
-        simply calls the corresponding function from the bot manager
+    def __save_checkpoint(self):
+        """save the page token of the next poll and the commands processed so far, if there is a checkpoint.
+        the saved token stays behind while commands of the pages before it still wait in unread_messages
         """
-        ret = self.bot_manager.add_username_to_wheel(username)
-        match ret:
-            case -3:
-                if self.verbose:
-                    self.__send_reply_to_livechat(f'{username}, the bot is not currently listening for usernames.')
-            case -2:
-                if self.verbose:
-                    self.__send_reply_to_livechat('Maximum name limit has been reached')
-            case -1:
-                if self.verbose:
-                    self.__send_reply_to_livechat(f'{username}, you are already on the wheel!')
-            case 0:
-                self.__send_reply_to_livechat(f'{username}, you have been added to the wheel!')
-    
-    def __here_command(self, username):
-        """function to try to add a given username to the list of wheel candidates
-        simply calls the corresponding function from the bot manager
+        if self.checkpoint is None:
+            return
+
+        if not self.unread_messages:
+            self.checkpoint.advance(self.paging_token)
+        try:
+            self.checkpoint.save()
+        except OSError as e:
+            print(f"Failed to save the youtube checkpoint, retrying after the next poll: {e}")
+
+    def __submit_command(self, message, username):
+        """start running the command of a ChatCommand, return value is the (message, username, future of the exit code) to wait on.
+        the future is None if the command is on cooldown for the user, it is dropped then
         """
-        ret = self.bot_manager.double_odds(username)
-        match ret:
-            case -4:
-                if self.verbose:
-                    self.__send_reply_to_livechat('doubling odds is not allowed during active listening')
-            case -3:
-                if self.verbose:
-                    self.__send_reply_to_livechat('doubling odds is not allowed right now.')
-            case -2:
-                if self.verbose:
-                    self.__send_reply_to_livechat(f'{username}, you already doubled your odds once')
-            case -1:
-                if self.verbose:
-                    self.__send_reply_to_livechat(f'{username}, you are not a member of the previos wheel!')
-            case 0:
-                self.__send_reply_to_livechat(f'{username}, your chances have been doubled!')
+        command = message.command
+        if not self.registry.ready(command, self.channel, username):
+            return message, username, None
+
+        metrics.inc('chat_commands_total', platform='youtube', command=command.name)
+        #privileged commands are authorized by who the author is, never by the name they display
+        user = (OWNER_IDENTITY if message.owner else identity(message.user_id)) if command.privileged else None
+        return message, username, self.registry.execute(command, self.bot_manager, self.channel, username, message.words, user)
 
+    def __respond(self, command, ret, username, sent_ms):
+        """report the exit code of a command to the chat, verbose replies only while enough quota is left"""
+        self.registry.respond(command, ret, username, self.replies, self.__verbose(), sent_ms / 1000)
 
     def run(self):
         """
         main bot loop that handles everything
         should run forever until the applciation is closed
         """
-        self.__send_reply_to_livechat("connection made!")
+        #the start time is saved right away, a bot that dies before its first command is processed still leaves it behind
+        self.__save_checkpoint()
+
+        #get the chat identification from the stream id
+        self.__wait_for_chat()
+
+        #a bot started again after an error keeps the queue it had, with the replies still waiting in it
+        if self.replies is None:
+            self.replies = ReplyQueue(self.__send_reply_to_livechat, self.REPLY_RATE, self.REPLY_BURST, platform='youtube',
+                                      max_length=self.MAX_REPLY_LENGTH)
+
+        #sent through the queue like any reply, so youtube being unreachable right now doesn't stop the bot
+        self.replies.put("connection made!")
 
         while True:
-            message_objs = self.__grab_messages()
+            cycle_start = time.monotonic()
+            polled = self.__grab_messages()
+
+            if polled is not None:
+                message_objs, next_page_token = polled
+                self.__setup_unread_messages(message_objs)
+
+                self.__process_for_commands()
+
+                #the token only moves past the page once its commands ran, so a page is never skipped
+                self.paging_token = next_page_token
+                self.__save_checkpoint()
+
+            #wait out what is left of the polling interval, or back off after a failure
+            time.sleep(self.__poll_delay(time.monotonic() - cycle_start))
+
+    async def run_async(self, session=None):
+        """
+        main bot loop for async mode, runs as a task on an already running event loop, like the one of the twitch bot.
+        a session can be passed to share one connection pool between the bots of multiple livestreams,
+        otherwise the bot opens its own.
+        should run forever until the applciation is closed
+        """
+        self.loop = asyncio.get_running_loop()
+        self.session = session or aiohttp.ClientSession()
+        #a bot started again after an error keeps the queue it had, with the replies still waiting in it
+        if self.replies is None:
+            self.replies = ReplyQueue(self.__send_reply_to_livechat_async, self.REPLY_RATE, self.REPLY_BURST, loop=self.loop, platform='youtube',
+                                      max_length=self.MAX_REPLY_LENGTH)
+
+        try:
+            #the start time is saved right away, a bot that dies before its first command is processed still leaves it behind
+            await self.loop.run_in_executor(None, self.__save_checkpoint)
+
+            #get the chat identification from the stream id
+            await self.__wait_for_chat_async()
+
+            #sent through the queue like any reply, so youtube being unreachable right now doesn't stop the bot
+            self.replies.put("connection made!")
+
+            while self.streaming:
+                self.streaming = await self.__stream_messages_async()
 
-            self.__setup_unread_messages(message_objs)
+            while True:
+                cycle_start = time.monotonic()
+                polled = await self.__grab_messages_async()
 
-            self.__process_for_commands()
+                if polled is not None:
+                    message_objs, next_page_token = polled
+                    self.__setup_unread_messages(message_objs)
 
-            #calculate the time in seconds before we are allowed to poll 
-            # for the next set of messages, wait a default of 5 seconds
-            interval = self.pollingIntervalMillis / 1000 if self.pollingIntervalMillis else 5
+                    await self.__process_for_commands_async()
 
-            time.sleep(interval)
+                    #the token only moves past the page once its commands ran, so a page is never skipped.
+                    #the checkpoint is fsynced, keep the loop running meanwhile
+                    self.paging_token = next_page_token
+                    await self.loop.run_in_executor(None, self.__save_checkpoint)
 
+                #wait out what is left of the polling interval, or back off after a failure
+                await asyncio.sleep(self.__poll_delay(time.monotonic() - cycle_start))
+        finally:
+            if session is None:
+                await self.session.close()
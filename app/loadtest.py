@@ -0,0 +1,605 @@
+"""Offline load test for the bots.
+
+Floods the bot manager, the twitch message handler and the youtube message pipeline with synthetic !wheel and !here
+commands, from both platforms at once, and reports throughput, p50/p99 command latency and memory.
+Nothing leaves the machine: the youtube data api and the wheel of names api are replaced by local http servers,
+the fake youtube api offering the streaming endpoint of the chat as well as polling, and the twitch commands are fed to the message handler from a fake channel, the same way twitchio hands them over.
+
+usage, from the app directory:
+    python loadtest.py --messages 20000 --trace-memory
+    python loadtest.py --sqlite    #keep the wheels in a sqlite database, as processes sharing a wheel do
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google.oauth2.credentials import Credentials
+
+import BotManager
+import CommandRegistry
+import SqliteStore
+import TwitchBot
+import YtBot
+from QuotaLedger import QuotaLedger
+from ChatCheckpoint import ChatCheckpoint
+from RateLimiter import RateLimiter
+from Metrics import metrics
+
+ADMIN = 'loadtest_admin'
+CHANNEL = 'loadtest'
+#directory the sqlite databases of the wheels are made in, None keeps the wheels in memory
+STATE_DB_DIR = None
+
+def percentile(values, q):
+    """return the q quantile of values, None if there are none"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class FakeServer:
+    """
+        Base of the local stand-ins for the web apis, serves requests from a thread of its own on a free port.
+        Subclasses implement handle(method, path, query, body) and return the (status, json response) pair.
+        A response can also be an iterator of bytes, which are streamed as they are produced, until the iterator ends.
+    """
+    def __init__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def __respond(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+
+                status, response = fake.handle(method, url.path, parse_qs(url.query), body)
+                try:
+                    if not isinstance(response, (dict, list)):
+                        self.send_response(status)
+                        self.send_header('Content-Type', 'application/json')
+                        self.end_headers()
+                        for piece in response:
+                            self.wfile.write(piece)
+                            self.wfile.flush()
+                        return
+
+                    payload = json.dumps(response).encode()
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except ConnectionError:
+                    #the client went away, like a bot killed in the middle of a poll
+                    pass
+
+            def do_GET(self):
+                self.__respond('GET')
+
+            def do_PUT(self):
+                self.__respond('PUT')
+
+            def do_POST(self):
+                self.__respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+class FakeWheelOfNames(FakeServer):
+    """stand-in for the private wheel endpoints of the wheel of names api"""
+    def __init__(self):
+        self.wheels = {}
+        super().__init__()
+
+    def handle(self, method, path, query, body):
+        if method == 'PUT' and path.endswith('/wheels/private'):
+            wheel_path = f'wheel-{body["config"]["title"]}'
+            self.wheels[wheel_path] = body['config']
+            return 200, {'data': {'path': wheel_path}}
+
+        if method == 'GET' and path.endswith('/wheels/private'):
+            return 200, {'data': {'wheels': [{'path': p, 'config': c} for p, c in self.wheels.items()]}}
+
+        wheel_path = path.rsplit('/', 1)[-1]
+        if method == 'GET' and wheel_path in self.wheels:
+            return 200, {'data': {'wheel': {'config': self.wheels[wheel_path]}}}
+
+        return 404, {'error': 'not found'}
+
+class FakeYouTube(FakeServer):
+    """
+        Stand-in for the youtube data api endpoints used by the youtube bot.
+        Every poll of the chat returns the page of the given chat messages its page token points at.
+        A poll without a page token gets the next page no poll was served yet, like a bot starting on a chat that is already going.
+        The messages are either all in the chat from the start, stamped with the time they are first served,
+        or sent to it at a steady rate like a live chat, stamped with the time they were sent.
+        A poll without a page token starts a page before the newest message served, like youtube hands a new reader the recent chat.
+    """
+    def __init__(self, messages, page_size, streaming=False, rate=None, polling_interval_ms=0):
+        """fields:
+        messages: (author channel id, text) pairs, in the order they are sent to the chat
+        page_size: amount of messages returned per poll, or at most per response of the stream
+        streaming: if the streaming endpoint is offered. it streams the messages as one json array, a page as soon as
+                   there are messages the stream didn't send yet. a stream opened once every message was served counts as a poll after the end
+        rate: messages sent to the chat per second, counted from the first request for messages. None if they are all there at once
+        polling_interval_ms: the pollingIntervalMillis the polls ask the bot to wait
+        started: time.time() of the first request for messages, when rate is set
+        served: amount of messages served so far
+        stamps: publishedAt of the messages served so far, when rate is not set, so a message read twice keeps its time
+        polls_after_end: polls received after every message was served. Once there is one,
+                         the bot has finished processing every message, since it only polls again after a full cycle
+        replies: amount of replies the bot sent to the chat
+        """
+        self.messages = messages
+        self.page_size = page_size
+        self.served = 0
+        self.stamps = {}
+        self.polls_after_end = 0
+        self.replies = 0
+        self.streaming = streaming
+        self.rate = rate
+        self.polling_interval_ms = polling_interval_ms
+        self.started = None
+        self.lock = threading.Lock()
+        super().__init__()
+
+    def done(self):
+        return self.polls_after_end > 0
+
+    def handle(self, method, path, query, body):
+        if path.endswith('/liveBroadcasts'):
+            return 200, {'items': [{'snippet': {'liveChatId': 'loadtest-chat'}}]}
+
+        if path.endswith('/channels'):
+            return 200, {'items': [{'snippet': {'title': f'yt_{query["id"][0]}'}}]}
+
+        if path.endswith('/liveChat/messages') and method == 'POST':
+            with self.lock:
+                self.replies += 1
+            return 200, {}
+
+        if path.endswith('/liveChat/messages/stream'):
+            if not self.streaming:
+                return 404, {'error': 'streaming not offered'}
+            return 200, self.__stream(self.__start(query))
+
+        if path.endswith('/liveChat/messages'):
+            return 200, self.__page(self.__start(query))
+
+        return 404, {'error': 'not found'}
+
+    def __start(self, query):
+        """index of the first message a poll or stream is served from"""
+        if 'pageToken' in query:
+            return int(query['pageToken'][0].split('-')[1])
+        return max(0, self.served - self.page_size)
+
+    def __sent(self):
+        """amount of messages sent to the chat so far"""
+        if self.rate is None:
+            return len(self.messages)
+        if self.started is None:
+            self.started = time.time()
+        return min(len(self.messages), int((time.time() - self.started) * self.rate))
+
+    def __published(self, index):
+        """publishedAt of a message, the time it was sent at in a live chat, and the time it was first served otherwise.
+        only called with the lock held
+        """
+        if self.rate is not None:
+            return datetime.fromtimestamp(self.started + index / self.rate, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+        if index not in self.stamps:
+            self.stamps[index] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+        return self.stamps[index]
+
+    def __page(self, start):
+        """serve the page of the messages sent to the chat, starting at start"""
+        with self.lock:
+            page = self.messages[start:min(start + self.page_size, self.__sent())]
+            if not page and start == len(self.messages):
+                self.polls_after_end += 1
+            self.served = max(self.served, start + len(page))
+            published = [self.__published(start + i) for i in range(len(page))]
+
+        items = [{
+            'id': f'msg-{start + i}',
+            'snippet': {
+                'type': 'textMessageEvent',
+                'authorChannelId': author,
+                'publishedAt': published[i],
+                'textMessageDetails': {'messageText': text},
+            },
+            'authorDetails': {'channelId': author, 'displayName': f'yt_{author}'},
+        } for i, (author, text) in enumerate(page)]
+
+        return {'items': items, 'nextPageToken': f'page-{start + len(page)}', 'pollingIntervalMillis': self.polling_interval_ms}
+
+    def __stream(self, start):
+        """stream the messages from start on as one json array, a page as soon as there are messages to send, until the last one was sent"""
+        yield b'['
+        separator = b''
+        while True:
+            page = self.__page(start)
+            if page['items']:
+                yield separator + json.dumps(page).encode()
+                separator = b','
+                start += len(page['items'])
+            elif start == len(self.messages):
+                break
+            else:
+                time.sleep(0.01)
+        yield b']'
+
+class FakeChannel:
+    """stand-in for a twitchio channel, keeps the replies instead of sending them"""
+    def __init__(self, name):
+        self.name = name
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+def twitch_message(channel, author, text):
+    """build the message twitchio hands to event_message"""
+    return SimpleNamespace(
+        echo=False,
+        content=text,
+        author=SimpleNamespace(name=author),
+        channel=channel,
+        timestamp=datetime.now(timezone.utc).replace(tzinfo=None),
+    )
+
+def new_manager(max_users):
+    manager = BotManager.BotManager(max_users, 'loadtest-key', [ADMIN])
+    store = None
+    if STATE_DB_DIR is not None:
+        store = SqliteStore.SqliteStore(os.path.join(tempfile.mkdtemp(dir=STATE_DB_DIR), 'wheels.db'))
+    manager.add_wheel(CHANNEL, 'loadtest', store=store)
+    return manager
+
+def start_collecting(manager):
+    manager.toggle_listening(CHANNEL, ADMIN, True).result()
+
+def start_doubling(manager):
+    manager.toggle_listening(CHANNEL, ADMIN, False).result()
+    manager.toggle_doubling(CHANNEL, ADMIN).result()
+
+def drain(manager):
+    """wait until every command submitted so far was executed, with a command that changes nothing"""
+    manager.toggle_doubling(CHANNEL, 'not an admin').result()
+
+def reset_metrics(samples):
+    """start a scenario with an empty registry, keeping every latency sample"""
+    with metrics.lock:
+        metrics.counters.clear()
+        metrics.summaries.clear()
+        metrics.samples = samples
+
+def recorded_latencies(platform):
+    summary = metrics.summaries.get(('reply_latency_seconds', (('platform', platform),)))
+    return list(summary[2]) if summary else []
+
+class Scenario:
+    """measures one scenario: wall time, latencies and, if enabled, the peak of traced memory"""
+    def __init__(self, name, trace_memory):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.latencies = []
+        self.commands = 0
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.peak_memory = None
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def row(self):
+        p50 = percentile(self.latencies, 0.5)
+        p99 = percentile(self.latencies, 0.99)
+        ms = lambda value: f'{value * 1000:.2f}' if value is not None else '-'
+        memory = f'{self.peak_memory / 2**20:.1f}' if self.peak_memory is not None else '-'
+        return [self.name, str(self.commands), f'{self.elapsed:.2f}', f'{self.commands / self.elapsed:.0f}', ms(p50), ms(p99), memory]
+
+def bench_manager(n, trace_memory):
+    """both platforms submit n/2 !wheel commands each from their own thread, then everyone sends !here"""
+    manager = new_manager(n)
+    start_collecting(manager)
+
+    def flood(names, command, latencies):
+        for name in names:
+            submitted = time.perf_counter()
+            future = command(CHANNEL, name)
+            future.add_done_callback(lambda _, submitted=submitted: latencies.append(time.perf_counter() - submitted))
+
+    results = []
+    with Scenario('manager !wheel', trace_memory) as scenario:
+        threads = [threading.Thread(target=flood, args=([f'{p}_{i}' for i in range(n // 2)], manager.add_username_to_wheel, scenario.latencies))
+                   for p in ('tw', 'yt')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        drain(manager)
+        scenario.commands = n // 2 * 2
+    results.append(scenario)
+
+    start_doubling(manager)
+    with Scenario('manager !here', trace_memory) as scenario:
+        threads = [threading.Thread(target=flood, args=([f'{p}_{i}' for i in range(n // 2)], manager.double_odds, scenario.latencies))
+                   for p in ('tw', 'yt')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        drain(manager)
+        scenario.commands = n // 2 * 2
+    results.append(scenario)
+
+    return results
+
+async def flood_twitch(bot, channel, names, command, latencies, concurrency=500):
+    """send a twitch command from every name, concurrency messages at a time"""
+
+    async def one(name):
+        started = time.perf_counter()
+        await bot.event_message(twitch_message(channel, name, f'!{command}'))
+        latencies.append(time.perf_counter() - started)
+
+    for i in range(0, len(names), concurrency):
+        await asyncio.gather(*(one(name) for name in names[i:i + concurrency]))
+
+def new_ytbot(manager, fake_youtube, checkpoint=None, streaming=False):
+    """a youtube bot in async mode talking to the fake youtube api, with polling and replies unthrottled"""
+    YtBot.YT_API_URL = f'{fake_youtube.url}/youtube/v3'
+    credentials = Credentials(token='loadtest-token')
+    ytbot = YtBot.YtBot(manager, True, credentials, 'loadtest-stream', CHANNEL, quota=QuotaLedger(10**12), checkpoint=checkpoint,
+                        streaming=streaming)
+    ytbot.scheduler.default_interval = 0
+    ytbot.scheduler.idle_interval = 0
+    ytbot.REPLY_RATE = ytbot.REPLY_BURST = 10**9
+    return ytbot
+
+def youtube_messages(names, command, noise):
+    """chat messages of the given authors sending command, mixed with noise plain chat messages per command"""
+    messages = []
+    for name in names:
+        messages.append((name, command))
+        messages.extend((f'lurker_{random.randrange(10**6)}', 'hello chat') for _ in range(noise))
+    return messages
+
+async def wait_for_replies(reply_queues):
+    while not all(replies.idle() for replies in reply_queues):
+        await asyncio.sleep(0.005)
+
+async def run_youtube(ytbot, fake_youtube):
+    task = asyncio.create_task(ytbot.run_async())
+    while not fake_youtube.done():
+        await asyncio.sleep(0.005)
+    await wait_for_replies([ytbot.replies])
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+def bench_platforms(n, noise, page_size, trace_memory):
+    """twitch and youtube flood the same bot manager at once, n/2 commands each, first !wheel, then !here"""
+    async def scenario_run():
+        manager = new_manager(n)
+        results = []
+
+        for command, prepare in (('wheel', start_collecting), ('here', start_doubling)):
+            prepare(manager)
+            reset_metrics(n)
+            twitch_names = [f'tw_{i}' for i in range(n // 2)]
+            fake_youtube = FakeYouTube(youtube_messages([f'yt_{i}' for i in range(n // 2)], f'!{command}', noise), page_size)
+            twbot = TwitchBot.TwitchBot(manager, 'oauth:loadtest', [CHANNEL], True)
+            twbot.REPLY_RATE = twbot.REPLY_BURST = 10**9
+            ytbot = new_ytbot(manager, fake_youtube)
+            channel = FakeChannel(CHANNEL)
+
+            with Scenario(f'twitch+youtube !{command}', trace_memory) as scenario:
+                twitch_latencies = []
+                await asyncio.gather(flood_twitch(twbot, channel, twitch_names, command, twitch_latencies),
+                                     run_youtube(ytbot, fake_youtube))
+                drain(manager)
+                await wait_for_replies(twbot.reply_queues.values())
+                #youtube latency is from the time the message was published until its reply was sent
+                scenario.latencies = twitch_latencies + recorded_latencies('youtube')
+                scenario.commands = len(twitch_names) + n // 2
+            results.append(scenario)
+            fake_youtube.stop()
+
+        return results
+
+    return asyncio.run(scenario_run())
+
+def bench_youtube_streaming(n, noise, page_size, trace_memory, chat_seconds=5, polling_interval_ms=1000):
+    """n youtube viewers send !wheel to a live chat over chat_seconds, read by a bot polling it at the interval youtube asks for,
+    by a bot streaming it, and by a bot that tries to stream it, finds no streaming, and polls instead.
+    the latency is from the time a message was sent to the chat until its reply was sent
+    """
+    async def scenario_run():
+        results = []
+        for name, offered, streaming in (('youtube polled !wheel, live', False, False), ('youtube streamed !wheel, live', True, True),
+                                         ('youtube stream fallback, live', False, True)):
+            manager = new_manager(n)
+            start_collecting(manager)
+            reset_metrics(n)
+            messages = youtube_messages([f'yt_{i}' for i in range(n)], '!wheel', noise)
+            fake_youtube = FakeYouTube(messages, page_size, offered, len(messages) / chat_seconds, polling_interval_ms)
+            ytbot = new_ytbot(manager, fake_youtube, streaming=streaming)
+
+            with Scenario(name, trace_memory) as scenario:
+                await run_youtube(ytbot, fake_youtube)
+                drain(manager)
+                scenario.latencies = recorded_latencies('youtube')
+                scenario.commands = n
+            results.append(scenario)
+            fake_youtube.stop()
+
+            usernames, _ = manager.wheels[CHANNEL].snapshot(None, while_listening=True)
+            mode = 'streamed' if ytbot.streaming else 'polled'
+            print(f'{name}: {mode}, {len(usernames)} of {n} viewers joined')
+        return results
+
+    return asyncio.run(scenario_run())
+
+def bench_youtube_restart(n, noise, page_size, trace_memory):
+    """n youtube viewers send !wheel, and the youtube bot is killed once half of the chat was read.
+    a new bot resumes from the checkpoint the first one saved, every viewer has to join, and every command should run once
+    """
+    async def scenario_run():
+        manager = new_manager(n)
+        start_collecting(manager)
+        reset_metrics(n)
+        fake_youtube = FakeYouTube(youtube_messages([f'yt_{i}' for i in range(n)], '!wheel', noise), page_size)
+        checkpoint_path = os.path.join(tempfile.mkdtemp(prefix='loadtest-checkpoint-'), 'youtube.checkpoint')
+
+        with Scenario('youtube restart', trace_memory) as scenario:
+            ytbot = new_ytbot(manager, fake_youtube, ChatCheckpoint(checkpoint_path))
+            task = asyncio.create_task(ytbot.run_async())
+            while fake_youtube.served < len(fake_youtube.messages) // 2:
+                await asyncio.sleep(0.001)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+            #the new bot reads the checkpoint from the file, as a restarted process would
+            ytbot = new_ytbot(manager, fake_youtube, ChatCheckpoint(checkpoint_path))
+            await run_youtube(ytbot, fake_youtube)
+            drain(manager)
+            scenario.latencies = recorded_latencies('youtube')
+            scenario.commands = n
+
+        fake_youtube.stop()
+        ran = sum(value for (name, labels), value in metrics.counters.items() if name == 'chat_commands_total')
+        usernames, _ = manager.wheels[CHANNEL].snapshot(None, while_listening=True)
+        #every viewer who joined ran their command at least once, whatever ran beyond that ran twice
+        lost = n - len(usernames)
+        print(f'youtube restart: {len(usernames)} of {n} viewers joined, {lost} commands lost, {ran - len(usernames)} commands ran twice')
+        return [scenario]
+
+    return asyncio.run(scenario_run())
+
+def bench_raid(n, trace_memory):
+    """a raid on twitch: n/2 viewers join the wheel once each, while 10 spammers send the other n/2 commands, all mixed together.
+    the commands go through the rate limiter, only the latency of the viewers' joins is reported
+    """
+    async def scenario_run():
+        manager = new_manager(n)
+        start_collecting(manager)
+        reset_metrics(n)
+        registry = CommandRegistry.default_registry(RateLimiter(backlog=manager.backlog))
+        twbot = TwitchBot.TwitchBot(manager, 'oauth:loadtest', [CHANNEL], True, registry)
+        twbot.REPLY_RATE = twbot.REPLY_BURST = 10**9
+        channel = FakeChannel(CHANNEL)
+
+        messages = [(f'raider_{i}', True) for i in range(n // 2)] + [(f'spammer_{i % 10}', False) for i in range(n - n // 2)]
+        random.shuffle(messages)
+
+        with Scenario('twitch raid, half spam', trace_memory) as scenario:
+            async def one(name, viewer):
+                started = time.perf_counter()
+                await twbot.event_message(twitch_message(channel, name, '!wheel'))
+                if viewer:
+                    scenario.latencies.append(time.perf_counter() - started)
+
+            for i in range(0, len(messages), 500):
+                await asyncio.gather(*(one(name, viewer) for name, viewer in messages[i:i + 500]))
+            drain(manager)
+            await wait_for_replies(twbot.reply_queues.values())
+            scenario.commands = len(messages)
+
+        shed = sum(value for (name, _), value in metrics.counters.items() if name == 'commands_shed_total')
+        usernames, _ = manager.wheels[CHANNEL].snapshot(None, while_listening=True)
+        joined = sum(1 for name in usernames if name.startswith('raider_'))
+        print(f'raid: {shed} of {n - n // 2} spam commands shed, {joined} of {n // 2} viewers joined')
+        return [scenario]
+
+    return asyncio.run(scenario_run())
+
+def bench_wheel_sync(n, trace_memory):
+    """upload a wheel of n users to the fake wheel of names, upload it again unchanged, load it back, draw winners from it,
+    then export it to an archive of each format and import it back
+    """
+    fake_won = FakeWheelOfNames()
+    manager = new_manager(n)
+    manager.archive_dir = tempfile.mkdtemp(prefix='loadtest-archive-')
+    manager.wheels[CHANNEL].wheel_sync.api_url = fake_won.url
+    start_collecting(manager)
+    for i in range(n):
+        manager.add_username_to_wheel(CHANNEL, f'user_{i}')
+    start_doubling(manager)
+
+    results = []
+    draw_100 = lambda channel, user: manager.draw(channel, user, 100, 'loadtest')
+    export_jsonl = lambda channel, user: manager.export_wheel(channel, user, 'jsonl')
+    import_jsonl = lambda channel, user: manager.import_wheel(channel, user, 'jsonl')
+    for name, action in (('wheel upload', manager.create_wheel), ('wheel upload, unchanged', manager.create_wheel),
+                         ('wheel load', manager.load_wheel), ('draw 1 winner', manager.draw), ('draw 100 winners', draw_100),
+                         ('export binary archive', manager.export_wheel), ('import binary archive', manager.import_wheel),
+                         ('export jsonl archive', export_jsonl), ('import jsonl archive', import_jsonl)):
+        with Scenario(name, trace_memory) as scenario:
+            started = time.perf_counter()
+            ret = action(CHANNEL, ADMIN)
+            scenario.latencies = [time.perf_counter() - started]
+            scenario.commands = 1
+        #draws and archives hand back their details along with the exit code
+        if isinstance(ret, tuple):
+            ret = ret[0]
+        if ret != 0:
+            print(f'{name} failed with exit code {ret}')
+        results.append(scenario)
+
+    fake_won.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='offline load test for the wheel of names chat bots')
+    parser.add_argument('--messages', type=int, default=20000, help='commands per scenario, split between the platforms')
+    parser.add_argument('--noise', type=int, default=3, help='plain youtube chat messages sent along with every command')
+    parser.add_argument('--page-size', type=int, default=2000, help='messages returned per poll of the fake youtube chat')
+    parser.add_argument('--trace-memory', action='store_true', help='report the peak of traced memory, slows the scenarios down')
+    parser.add_argument('--sqlite', action='store_true', help='keep the wheels in a sqlite database instead of in memory')
+    args = parser.parse_args()
+
+    global STATE_DB_DIR
+    if args.sqlite:
+        STATE_DB_DIR = tempfile.mkdtemp(prefix='loadtest-')
+
+    results = bench_manager(args.messages, args.trace_memory)
+    results += bench_platforms(args.messages, args.noise, args.page_size, args.trace_memory)
+    #a live chat of a thousand messages per second, within what a poll can carry
+    results += bench_youtube_streaming(args.messages // 16, args.noise, args.page_size, args.trace_memory)
+    results += bench_youtube_restart(args.messages // 2, args.noise, args.page_size, args.trace_memory)
+    results += bench_raid(args.messages, args.trace_memory)
+    results += bench_wheel_sync(args.messages, args.trace_memory)
+
+    header = ['scenario', 'commands', 'seconds', 'commands/s', 'p50 ms', 'p99 ms', 'peak MiB']
+    rows = [header] + [scenario.row() for scenario in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,206 @@
 import BotManager
+import CommandRegistry
+import Journal
+import PostgresStore
+import SqliteStore
 import TwitchBot
 import YtBot
+import ChatCheckpoint
+import QuotaLedger
+import RateLimiter
+from Metrics import metrics
 from yt_auth import Authorize
+import os
 import json
+import time
+import asyncio
 import threading
+import aiohttp
 
-#setup the bots with settings from the config, and run the oauth flow for the youtube bot.
+#setup the bots with settings from the config. the youtube bots are set up in the background once the twitch bot runs,
+#since their oauth flow can wait for a browser login
 with open('config.json') as config_file:
     config = json.load(config_file)
 
-allowed_users = [user.lower() for user in config['allowed_users']]
+#seconds before a youtube bot that stopped on an error is started again
+YTBOT_RESTART_DELAY = 30
+#longest wait between two attempts at setting up the youtube bots, the wait starts at YTBOT_RESTART_DELAY and doubles after every failure
+YTBOT_SETUP_MAX_DELAY = 600
 
-yt_flow_response = Authorize(config)
+#the bots this process runs. the platforms can be split over processes, sharing the wheels through state_db, on other hosts too if it is a postgresql database
+bots = config.get('bots', ['twitch', 'youtube'])
 
-manager = BotManager.BotManager(config['max_users'], config['WoN_api_key'], allowed_users.copy(), config['wheel_name'])
-twbot = TwitchBot.TwitchBot(manager, config['oauth_token'], [config['channel']], config['verbose'])
-ytbot = YtBot.YtBot(manager, config['verbose'], yt_flow_response, config['yt_livestream_ID'])
+def stream_admins(config, stream):
+    """the (twitch logins, youtube channel ids) of the admins of a stream, who can run the privileged commands on its wheel only.
+    the stream's own allowed_users and yt_admin_channel_ids if it has them, the top level ones otherwise
+    """
+    logins = [user.lower() for user in stream.get('allowed_users', config.get('allowed_users', []))]
+    return logins, stream.get('yt_admin_channel_ids', config.get('yt_admin_channel_ids', []))
+
+def admin_identities(logins, yt_channel_ids):
+    """the allowed users of a wheel in the bot manager. youtube admins are authorized by the id of their channel,
+    and the owner of a chat by the flag youtube sets on their messages
+    """
+    identities = logins + [YtBot.identity(channel_id) for channel_id in yt_channel_ids]
+    if config.get('yt_owner_is_admin', True):
+        identities.append(YtBot.OWNER_IDENTITY)
+    return identities
+
+def configured_streams(config):
+    """the streams the bots run in, as a list of (twitch channel, wheel name, youtube livestream ids, admins), admins as in stream_admins.
+    taken from "streams" if set, otherwise a single stream is made from the top level channel, wheel_name and yt_livestream_ID
+    """
+    streams = config.get('streams') or [{'channel': config['channel'], 'wheel_name': config['wheel_name'],
+                                         'yt_livestream_ID': config.get('yt_livestream_ID', [])}]
+    result = []
+    for stream in streams:
+        #a single livestream id, or a list of them to run one youtube bot per livestream
+        livestream_ids = stream.get('yt_livestream_ID', [])
+        if isinstance(livestream_ids, str):
+            livestream_ids = [livestream_ids]
+        result.append((stream['channel'], stream['wheel_name'], livestream_ids, stream_admins(config, stream)))
+    return result
+
+def open_store(state_db):
+    """the database the wheels are shared through, a postgresql database if state_db is its url, a sqlite database file otherwise"""
+    if state_db.startswith(('postgres://', 'postgresql://')):
+        return PostgresStore.PostgresStore(state_db)
+    return SqliteStore.SqliteStore(state_db)
+
+streams = configured_streams(config)
+
+#the wheels are kept in a database shared with the other processes if state_db is configured, otherwise in memory
+store = open_store(config['state_db']) if config.get('state_db') else None
+
+manager = BotManager.BotManager(config['max_users'], config['WoN_api_key'], admin_identities(*stream_admins(config, {})),
+                                 config.get('draw_log'), config.get('archive_dir'))
+for channel, wheel_name, _, admins in streams:
+    #a wheel in memory is journaled to disk and restored on startup if a state directory is configured.
+    #with multiple streams, each channel gets a directory of its own in it
+    journal = None
+    if store is None and config.get('state_dir'):
+        state_dir = os.path.join(config['state_dir'], channel.lower()) if config.get('streams') else config['state_dir']
+        journal = Journal.Journal(state_dir)
+    manager.add_wheel(channel, wheel_name, journal, store, admin_identities(*admins))
+if config.get('auto_sync_interval'):
+    manager.start_auto_sync(config['auto_sync_interval'])
+
+#a single twitch bot joins the channels of all streams
+#the bots of both platforms understand the same commands, and share their cooldowns and flood control
+#the admins of a stream are only exempt from the flood control in its own channel
+limiter = RateLimiter.RateLimiter(**config.get('rate_limit', {}), backlog=manager.backlog,
+                                  exempt=[(channel.lower(), user) for channel, _, _, (logins, yt_channel_ids) in streams
+                                          for user in logins + yt_channel_ids])
+registry = CommandRegistry.default_registry(limiter)
+
+twbot = None
+if 'twitch' in bots:
+    twbot = TwitchBot.TwitchBot(manager, config['oauth_token'], [channel for channel, _, _, _ in streams], config['verbose'], registry)
+#all youtube bots use the quota of the same google project
+quota = QuotaLedger.QuotaLedger(config.get('yt_quota_budget', 10000))
+
+def ytbot_checkpoint(livestream_id):
+    """return the checkpoint the youtube bot of a livestream resumes from after a restart, kept in the state directory if one is configured"""
+    if not config.get('state_dir'):
+        return None
+    return ChatCheckpoint.ChatCheckpoint(os.path.join(config['state_dir'], 'youtube', f'{livestream_id}.checkpoint'))
+
+def create_ytbots():
+    """run the oauth flow, or reuse the cached credentials, and create a youtube bot per livestream.
+    blocks until the login is done, so it is run in the background
+    """
+    if 'youtube' not in bots:
+        return []
+
+    yt_credentials = Authorize(config)
+    return [YtBot.YtBot(manager, config['verbose'], yt_credentials, livestream_id, channel,
+                        config.get('yt_dedup_window', 300), config.get('yt_dedup_interval', 1), quota, registry,
+                        ytbot_checkpoint(livestream_id), config.get('yt_streaming', True))
+            for channel, _, livestream_ids, _ in streams
+            for livestream_id in livestream_ids]
+
+def ytbot_setup_delay(attempt):
+    """seconds to wait after the given failed attempt at setting up the youtube bots, counted from 0"""
+    return min(YTBOT_RESTART_DELAY * 2 ** attempt, YTBOT_SETUP_MAX_DELAY)
+
+async def run_ytbots():
+    """set up the youtube bots without blocking the loop, then run them all on it, sharing one connection pool.
+    a setup that fails, like when youtube can't be reached, is tried again until it succeeds, so the youtube bots come up once they can
+    """
+    attempt = 0
+    while True:
+        try:
+            ytbots = await asyncio.get_running_loop().run_in_executor(None, create_ytbots)
+            break
+        except Exception as e:
+            delay = ytbot_setup_delay(attempt)
+            print(f"Failed to start the youtube bots, retrying in {delay} seconds: {e!r}")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(run_ytbot_async(ytbot, session) for ytbot in ytbots))
+
+async def run_ytbot_async(ytbot, session):
+    """run one youtube bot on the loop, started again if it stops on an error, so one livestream can't take down the others or their session"""
+    while True:
+        try:
+            await ytbot.run_async(session)
+        except Exception as e:
+            print(f"The youtube bot of {ytbot.livestream_id} stopped, restarting it in {YTBOT_RESTART_DELAY} seconds: {e!r}")
+            metrics.inc('youtube_bot_restarts_total', livestream=ytbot.livestream_id)
+        await asyncio.sleep(YTBOT_RESTART_DELAY)
+
+def run_ytbot(ytbot):
+    """thread version of run_ytbot_async"""
+    while True:
+        try:
+            ytbot.run()
+        except Exception as e:
+            print(f"The youtube bot of {ytbot.livestream_id} stopped, restarting it in {YTBOT_RESTART_DELAY} seconds: {e!r}")
+            metrics.inc('youtube_bot_restarts_total', livestream=ytbot.livestream_id)
+        time.sleep(YTBOT_RESTART_DELAY)
+
+def run_ytbot_threads():
+    """set up the youtube bots, then run each of them in a thread of its own. a failed setup is tried again, like in run_ytbots"""
+    attempt = 0
+    while True:
+        try:
+            ytbots = create_ytbots()
+            break
+        except Exception as e:
+            delay = ytbot_setup_delay(attempt)
+            print(f"Failed to start the youtube bots, retrying in {delay} seconds: {e!r}")
+            time.sleep(delay)
+            attempt += 1
+
+    threads = [threading.Thread(target=run_ytbot, args=(ytbot,)) for ytbot in ytbots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 if __name__ == '__main__':
-    yt_thread = threading.Thread(target=ytbot.run)
-    tw_thread = threading.Thread(target=twbot.run)
+    if config.get('metrics_port'):
+        metrics.serve(config['metrics_port'])
+    if config.get('metrics_dump_path'):
+        metrics.start_dump(config['metrics_dump_path'], config.get('metrics_dump_interval', 60))
+
+    if config.get('yt_async', False):
+        #everything runs in this thread, on the event loop of the twitch bot if this process runs one
+        if twbot is not None:
+            twbot.loop.create_task(run_ytbots())
+            twbot.run()
+        else:
+            asyncio.run(run_ytbots())
+    else:
+        #the twitch bot connects right away, the youtube bots join once they are set up
+        threads = [threading.Thread(target=run_ytbot_threads)]
+        if twbot is not None:
+            threads.insert(0, threading.Thread(target=twbot.run))
 
-    yt_thread.start()
-    tw_thread.start()
+        for thread in threads:
+            thread.start()
 
-    yt_thread.join()
-    tw_thread.join()
\ No newline at end of file
+        for thread in threads:
+            thread.join()
@@ -1,13 +1,77 @@
+import os
+import time
+from google.auth.exceptions import RefreshError, TransportError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+#file the credentials are cached in, unless yt_token_path is set in the config
+TOKEN_PATH = 'yt_token.json'
+
+#attempts at refreshing the cached token while google can't be reached, and the seconds waited before the first retry, doubled for every retry after it
+REFRESH_ATTEMPTS = 4
+REFRESH_RETRY_DELAY = 2
+
+def load_credentials(token_path, scopes):
+    """load the cached credentials, refreshing them if the access token expired.
+    return value is the credentials, None if nothing is cached or the cached credentials can't be used anymore, like when access was revoked.
+    a refresh that can't reach google is retried, the credentials may still be good, so it doesn't mean a new login.
+    TransportError is raised if google still can't be reached after REFRESH_ATTEMPTS
+    """
+    if not os.path.exists(token_path):
+        return None
+
+    try:
+        credentials = Credentials.from_authorized_user_file(token_path, scopes)
+    except ValueError:
+        return None
+
+    if credentials.valid:
+        return credentials
+
+    if not credentials.refresh_token:
+        return None
+
+    for attempt in range(REFRESH_ATTEMPTS):
+        try:
+            credentials.refresh(Request())
+            break
+        except RefreshError:
+            return None
+        except TransportError as e:
+            if attempt == REFRESH_ATTEMPTS - 1:
+                raise
+            delay = REFRESH_RETRY_DELAY * 2 ** attempt
+            print(f"Failed to reach google to refresh the youtube token, retrying in {delay} seconds: {e}")
+            time.sleep(delay)
+
+    save_credentials(token_path, credentials)
+    return credentials
+
+def save_credentials(token_path, credentials):
+    """cache the credentials, readable by the owner only since the refresh token grants access to the youtube account"""
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as token_file:
+        token_file.write(credentials.to_json())
+
 def Authorize(config):
     """function to run the oauth flow for the youtube chatbot.
     scopes required are defined in the config, but should not be touched.
-    port to be used for the auth process is also taken from the 
+    port to be used for the auth process is also taken from the config
 
-    return value is the flow object as defined in the oauth lib.
+    the credentials are cached on disk, in the file yt_token_path of the config, and reused on the next start,
+    so the browser login is only needed the first time, or once the cached credentials were revoked.
+    the access token expires after an hour, it is renewed with the refresh token, here and by the bots while they run.
+
+    return value is the credentials, as defined in the google auth lib.
+    raises TransportError if google can't be reached to refresh the cached credentials, the login is not asked for again then
     """
-    
+    token_path = config.get('yt_token_path', TOKEN_PATH)
+
+    credentials = load_credentials(token_path, config['scopes'])
+    if credentials is not None:
+        return credentials
+
     flow = InstalledAppFlow.from_client_config({
         "installed": {
             "client_id": config["yt_client_id"],
@@ -18,9 +82,13 @@ def Authorize(config):
         }
     }, scopes=config["scopes"])
 
+    #offline access is what makes google hand out the refresh token
     flow.run_local_server(
         host='localhost',
         port=config['port'],
-        authorization_prompt_message="")
+        authorization_prompt_message="",
+        access_type='offline',
+        prompt='consent')
 
-    return flow
+    save_credentials(token_path, flow.credentials)
+    return flow.credentials